@@ -18,7 +18,8 @@ st.set_page_config(
 # Import shared utilities
 # -------------------------------
 from utils import (
-    initialize_session_state, ensure_dataframe_loaded, add_shared_sidebar
+    initialize_session_state, ensure_dataframe_loaded, add_shared_sidebar,
+    get_session_dataframe, get_custom_price_store
 )
 
 # Initialize session state
@@ -72,7 +73,7 @@ def home_page():
         st.error("❌ Failed to load equipment data. Please check the Excel file exists.")
         return
     
-    df = st.session_state.get('df')
+    df = get_session_dataframe()
     
     st.markdown("---")
     st.markdown("## 📊 Dashboard")
@@ -92,8 +93,7 @@ def home_page():
     
     with col3:
         if df is not None:
-            custom_count = sum(1 for idx, _ in df.iterrows() if st.session_state.get(f"price_{idx}", "").strip())
-            st.metric("🎯 Custom Prices", custom_count)
+            st.metric("🎯 Custom Prices", len(get_custom_price_store()))
         else:
             st.metric("🎯 Custom Prices", 0)
     
@@ -110,7 +110,7 @@ def home_page():
     with st.expander("🔍 Debug: Session State", expanded=False):
         st.write(f"**Customer Name:** '{st.session_state.get('customer_name', 'NOT SET')}'")
         st.write(f"**Global Discount:** {st.session_state.get('global_discount', 'NOT SET')}")
-        custom_prices_set = sum(1 for k, v in st.session_state.items() if k.startswith('price_') and v)
+        custom_prices_set = len(get_custom_price_store())
         st.write(f"**Custom Prices Count:** {custom_prices_set}")
     
     # Footer
@@ -0,0 +1,218 @@
+# Batch converter for Net Rates Calculator - headless, no Streamlit server needed
+#
+# Converts a folder of customer Syrinx or ERP exports into progress files
+# (the same JSON as "💾 Save Progress"), optionally with the admin Excel and
+# customer PDF for each one. Files are spread over a process pool; each worker
+# loads the rate card, conversion table and ERP matcher once.
+#
+# Usage:
+#   python batch_convert.py INPUT_DIR OUTPUT_DIR [--global-discount 0] [--xlsx] [--pdf HEADER.pdf]
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+SYRINX_EXTENSIONS = (".xlsx",)  # Legacy .xls would need xlrd, which is not a dependency
+ERP_EXTENSIONS = (".tsv", ".txt", ".csv", ".xlsx")
+SUMMARY_FILE = "batch_summary.csv"
+
+# Shared per worker process (set by init_worker)
+_worker = {}
+
+def init_worker():
+    """Load the rate card, conversion table and ERP matcher once for this worker process"""
+    import utils
+    import streamlit.logger
+    # Streamlit warns about the missing ScriptRunContext on every call outside `streamlit run`
+    streamlit.logger.set_log_level("error")
+    rate_card = utils.get_current_source("rate_card")
+    conversion = utils.get_current_source("conversion_table")
+    _worker["utils"] = utils
+    _worker["rate_card"] = rate_card
+    _worker["matcher"] = utils.compile_erp_matcher(conversion["data"], rate_card["data"], rate_card["index"])
+
+def detect_format(path):
+    """Syrinx (2 columns: code, price) or ERP export (7+ columns) - by extension, then by sheet width"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".tsv", ".txt", ".csv"):
+        return "erp"
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        first_row = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+    finally:
+        workbook.close()
+    return "erp" if len(first_row) >= 7 else "syrinx"
+
+def match_file(path, file_format):
+    """Match one file - returns ([(row position, price)], matched count, ignored codes, rows processed)"""
+    utils = _worker["utils"]
+    rate_card = _worker["rate_card"]
+    if file_format == "syrinx":
+        preview = utils.match_syrinx_prices(utils.read_syrinx_file(path), rate_card["data"], rate_card["index"])
+        matched = preview["matched"]
+        prices = list(zip(matched["position"].tolist(), matched["special_price"].tolist()))
+        return prices, len(matched), preview["ignored"], preview["total_processed"]
+
+    with open(path, "rb") as file:
+        results = utils.parse_erp_file(file, _worker["matcher"])
+    positions_by_code = rate_card["index"]["positions_by_code"]
+    prices = [
+        (positions_by_code[r["matched_code"]], r["final_price"])
+        for r in results
+        if r["status"] == "matched" and r["final_price"] is not None
+    ]
+    ignored = [r["erp_code"] for r in results if r["status"] != "matched"]
+    return prices, len(prices), ignored, len(results)
+
+def get_customer_name(path):
+    """Customer name of an input file - its file name without the extension"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+def new_summary(path, file_format):
+    """Empty summary row for one input file"""
+    return {
+        "file": os.path.basename(path),
+        "customer": get_customer_name(path),
+        "format": file_format,
+        "rows": 0,
+        "matched": 0,
+        "ignored": 0,
+        "outputs": "",
+        "skipped": "",
+        "error": "",
+    }
+
+def convert_file(path, output_dir, global_discount, file_format, write_xlsx, header_pdf):
+    """Convert one customer file into its progress JSON (and exports) - returns its summary row"""
+    utils = _worker["utils"]
+    rate_card = _worker["rate_card"]
+    customer_name = get_customer_name(path)
+    summary = new_summary(path, file_format)
+    try:
+        if file_format == "auto":
+            file_format = summary["format"] = detect_format(path)
+        prices, matched_count, ignored, rows = match_file(path, file_format)
+        summary.update(rows=rows, matched=matched_count, ignored=len(ignored))
+        if not rows:
+            # Notes, readmes and empty sheets - nothing to convert, so no progress file
+            summary["skipped"] = f"No {'ERP' if file_format == 'erp' else 'Syrinx'} rows found"
+            return summary
+
+        store = utils.CustomPriceStore(rate_card)
+        for position, price in prices:
+            store.set(int(position), str(price))
+        vector = utils.GroupDiscountVector(rate_card)
+
+        transport_charges = {f"transport_{i}": value for i, value in enumerate(utils.DEFAULT_TRANSPORT_CHARGES)}
+        save_data = utils.build_save_data(customer_name, global_discount, vector, store, transport_charges)
+        outputs = [f"{customer_name}.json.gz"]
+        with open(os.path.join(output_dir, outputs[0]), "wb") as f:
+            f.write(utils.encode_progress(save_data))
+
+        if write_xlsx or header_pdf:
+            net_prices, discount_percents = utils.price_rate_card_rows(rate_card, vector.effective(global_discount), store)
+            priced_df = utils.compose_rate_card(rate_card["data"], net_prices, discount_percents)
+
+        if write_xlsx:
+            admin_df = utils.create_admin_dataframe(priced_df, customer_name)
+            transport_df = utils.create_transport_dataframe()
+            outputs.append(f"{customer_name}_admin_pricelist.xlsx")
+            with open(os.path.join(output_dir, outputs[-1]), "wb") as f:
+                f.write(utils.create_admin_workbook(admin_df, transport_df, customer_name, global_discount))
+
+        if header_pdf:
+            with open(header_pdf, "rb") as header:
+                pdf_data = utils.generate_customer_pdf(
+                    priced_df, customer_name, header, store=store, rate_card_index=rate_card["index"]
+                )
+            if pdf_data is None:
+                raise RuntimeError("PDF generation failed")
+            outputs.append(f"{customer_name}_net_rates.pdf")
+            with open(os.path.join(output_dir, outputs[-1]), "wb") as f:
+                f.write(pdf_data)
+
+        summary["outputs"] = ", ".join(outputs)
+    except Exception as e:
+        summary["error"] = str(e)
+    return summary
+
+def find_input_files(input_dir, file_format):
+    """Customer files in a folder (Excel lock files skipped), sorted by name"""
+    extensions = {"syrinx": SYRINX_EXTENSIONS, "erp": ERP_EXTENSIONS}.get(file_format, SYRINX_EXTENSIONS + ERP_EXTENSIONS)
+    return sorted(
+        os.path.join(input_dir, name)
+        for name in os.listdir(input_dir)
+        if name.lower().endswith(extensions) and not name.startswith("~$")
+    )
+
+def find_duplicate_customers(files):
+    """Files sharing a customer name (acme.xlsx and acme.csv) - their outputs would overwrite each other"""
+    paths_by_customer = {}
+    for path in files:
+        paths_by_customer.setdefault(get_customer_name(path).lower(), []).append(path)
+    return {path for paths in paths_by_customer.values() if len(paths) > 1 for path in paths}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a folder of Syrinx/ERP exports into progress files")
+    parser.add_argument("input_dir", help="Folder of customer Syrinx (.xlsx) or ERP (.tsv/.txt/.csv/.xlsx) files")
+    parser.add_argument("output_dir", help="Folder for the progress JSON, exports and summary report")
+    parser.add_argument("--global-discount", type=float, default=0.0, help="Global discount %% for every customer")
+    parser.add_argument("--format", choices=["auto", "syrinx", "erp"], default="auto", help="Input file format")
+    parser.add_argument("--xlsx", action="store_true", help="Also write the admin Excel price list")
+    parser.add_argument("--pdf", metavar="HEADER_PDF", help="Also write the customer PDF using this header file")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    files = find_input_files(args.input_dir, args.format)
+    if not files:
+        print(f"No Syrinx/ERP files found in {args.input_dir}")
+        return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.time()
+    summaries = []
+    duplicates = find_duplicate_customers(files)
+    for path in sorted(duplicates):
+        summary = new_summary(path, args.format)
+        summary["error"] = "Another file has the same customer name - rename one of them"
+        summaries.append(summary)
+        print(f"{summary['file']}: ❌ {summary['error']}")
+    
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        futures = [
+            pool.submit(convert_file, path, args.output_dir, args.global_discount, args.format, args.xlsx, args.pdf)
+            for path in files
+            if path not in duplicates
+        ]
+        for done, future in enumerate(as_completed(futures), start=1):
+            summary = future.result()
+            summaries.append(summary)
+            if summary["error"]:
+                status = f"❌ {summary['error']}"
+            elif summary["skipped"]:
+                status = f"skipped - {summary['skipped']}"
+            else:
+                status = f"{summary['matched']} matched, {summary['ignored']} ignored"
+            print(f"[{done}/{len(futures)}] {summary['file']}: {status}")
+
+    summaries.sort(key=lambda summary: summary["file"])
+    summary_path = os.path.join(args.output_dir, SUMMARY_FILE)
+    with open(summary_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(summaries[0]))
+        writer.writeheader()
+        writer.writerows(summaries)
+
+    failed = sum(1 for summary in summaries if summary["error"])
+    skipped = sum(1 for summary in summaries if summary["skipped"])
+    print(f"\nConverted {len(files) - failed - skipped} of {len(files)} files in {time.time() - start:.1f}s "
+          f"({sum(s['matched'] for s in summaries)} matched, {sum(s['ignored'] for s in summaries)} ignored, "
+          f"{skipped} skipped)")
+    print(f"Summary report: {summary_path}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,13 +3,14 @@ import streamlit as st
 import pandas as pd
 import os
 import io
-import json
 
 # Import shared utilities (Streamlit runs from project root)
 from utils import (
     initialize_session_state, ensure_dataframe_loaded, get_available_pdf_files,
     TRANSPORT_TYPES, DEFAULT_TRANSPORT_CHARGES, SCRIPT_DIR, get_uk_time,
-    create_save_data, apply_loaded_data, add_shared_sidebar
+    get_progress_download, apply_loaded_data, add_shared_sidebar, get_session_dataframe,
+    get_custom_price_store, get_group_discount_vector, get_session_rate_card,
+    journal_edit, decode_progress, PROGRESS_FILE_TYPES
 )
 
 # Initialize session state
@@ -30,11 +31,7 @@ if st.session_state.get('_pending_load_data'):
     if not ensure_dataframe_loaded():
         st.error("❌ Failed to load equipment data.")
         st.stop()
-    df = st.session_state['df']
-    
-    # DEBUG: Show what we're loading
-    st.info(f"Loading: global_discount={loaded_data.get('global_discount')}, "
-            f"group_discounts count={len(loaded_data.get('group_discounts', {}))}")
+    df = get_session_dataframe()
     
     apply_loaded_data(loaded_data, df)
     st.toast(f"✅ Loaded progress for: {loaded_data.get('customer_name', 'Unknown')}")
@@ -47,7 +44,7 @@ if not ensure_dataframe_loaded():
     st.error("❌ Failed to load equipment data. Please check the Excel file.")
     st.stop()
 
-df = st.session_state['df']
+df = get_session_dataframe()
 
 st.title("⚙️ Discounts & Setup")
 st.markdown("Configure customer details, global discount, and group-level discounts.")
@@ -145,31 +142,19 @@ global_discount = st.number_input(
     on_change=update_global_discount
 )
 
-# Pre-calculate group info for bulk operations
-grouped_df = df.groupby(["GroupName", "Sub Section"])
-group_keys = list(grouped_df.groups.keys())
-
-# Build excluded groups set
-excluded_groups = set()
-for (group, subsection), group_df in grouped_df:
-    if group_df["ExcludeFromGlobalDiscount"].any():
-        excluded_groups.add((group, subsection))
+# Group registry of the rate card (group ids, excluded groups) and this session's discounts
+rate_card_index = get_session_rate_card()["index"]
+group_keys = rate_card_index["keys"]
+excluded_groups = rate_card_index["excluded_keys"]
+discount_vector = get_group_discount_vector()
 
 # Quick action buttons
 col1, col2, col3 = st.columns(3)
 
 with col1:
     if st.button("🔄 Apply to All Groups", type="primary", use_container_width=True):
-        applied = 0
-        skipped = 0
-        for group, subsection in group_keys:
-            discount_key = f"{group}_{subsection}_discount"
-            if (group, subsection) in excluded_groups:
-                st.session_state[discount_key] = 0.0
-                skipped += 1
-            else:
-                st.session_state[discount_key] = global_discount
-                applied += 1
+        with journal_edit("Apply to All Groups"):
+            applied, skipped = discount_vector.apply_to_all(global_discount)
         
         msg = f"✅ {applied} groups set to {global_discount}%"
         if skipped > 0:
@@ -178,33 +163,24 @@ with col1:
         st.rerun()
 
 with col2:
-    custom_count = sum(1 for idx, _ in df.iterrows() if st.session_state.get(f"price_{idx}", "").strip())
+    custom_count = len(get_custom_price_store())
     if st.button(f"🗑️ Clear Custom Prices ({custom_count})", use_container_width=True):
-        cleared = 0
-        for idx, _ in df.iterrows():
-            price_key = f"price_{idx}"
-            input_key = f"input_{idx}"
-            if st.session_state.get(price_key, "").strip():
-                st.session_state[price_key] = ""
-                cleared += 1
-            if input_key in st.session_state:
-                st.session_state[input_key] = ""
+        with journal_edit("Clear Custom Prices"):
+            cleared = get_custom_price_store().clear_all()
         st.session_state['pending_prices'] = {}
+        st.session_state['special_rate_edits'] = {}
         st.success(f"✅ Cleared {cleared} custom prices")
         st.rerun()
 
 with col3:
     if st.button("🔄 Reset All", use_container_width=True):
-        # Reset group discounts
-        for group, subsection in group_keys:
-            discount_key = f"{group}_{subsection}_discount"
-            st.session_state[discount_key] = 0.0
-        # Clear custom prices
-        for idx, _ in df.iterrows():
-            st.session_state[f"price_{idx}"] = ""
-            if f"input_{idx}" in st.session_state:
-                st.session_state[f"input_{idx}"] = ""
+        with journal_edit("Reset All"):
+            # Reset group discounts
+            discount_vector.reset()
+            # Clear custom prices
+            get_custom_price_store().clear_all()
         st.session_state['pending_prices'] = {}
+        st.session_state['special_rate_edits'] = {}
         st.success("✅ All discounts reset")
         st.rerun()
 
@@ -219,18 +195,22 @@ if excluded_groups:
     st.info(f"🔒 {len(excluded_groups)} group(s) excluded from global discount")
 
 # Initialize group discounts
-for group, subsection in group_keys:
-    discount_key = f"{group}_{subsection}_discount"
-    if discount_key not in st.session_state:
-        is_excluded = (group, subsection) in excluded_groups
-        st.session_state[discount_key] = 0.0 if is_excluded else global_discount
+discount_vector.initialize(global_discount)
+
+def update_group_discount(group_id):
+    """Callback to sync a group widget value to the discount vector"""
+    group, subsection = group_keys[group_id]
+    with journal_edit(f"{group} - {subsection} discount"):
+        discount_vector.set(group_id, st.session_state[f"_group_discount_{group_id}"])
 
 # Display in 3 columns
 cols = st.columns(3)
-for i, (group, subsection) in enumerate(group_keys):
-    col = cols[i % 3]
-    discount_key = f"{group}_{subsection}_discount"
+for group_id, (group, subsection) in enumerate(group_keys):
+    col = cols[group_id % 3]
+    widget_key = f"_group_discount_{group_id}"
     is_excluded = (group, subsection) in excluded_groups
+    # The vector is the source of truth - widgets are re-synced so bulk actions show up
+    st.session_state[widget_key] = float(discount_vector.values[group_id])
     
     with col:
         label = f"🔒 {group} - {subsection}" if is_excluded else f"{group} - {subsection}"
@@ -239,7 +219,9 @@ for i, (group, subsection) in enumerate(group_keys):
             min_value=0.0,
             max_value=100.0,
             step=0.01,
-            key=discount_key,
+            key=widget_key,
+            on_change=update_group_discount,
+            args=(group_id,),
             help="Excluded from global discount" if is_excluded else None
         )
 
@@ -275,33 +257,30 @@ with col1:
     if customer_name:
         safe_name = customer_name.strip().replace(" ", "_").replace("/", "_")
         timestamp = get_uk_time().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"{safe_name}_progress_{timestamp}.json"
-        
-        save_data = create_save_data(customer_name, df)
-        json_data = json.dumps(save_data, indent=2)
+        filename = f"{safe_name}_progress_{timestamp}.json.gz"
         
         st.download_button(
             label="💾 Save Progress",
-            data=json_data,
+            data=get_progress_download(customer_name, df),
             file_name=filename,
-            mime="application/json",
+            mime="application/gzip",
             use_container_width=True
         )
     else:
         st.button("💾 Save Progress", disabled=True, use_container_width=True, help="Enter customer name first")
 
 with col2:
-    uploaded_file = st.file_uploader("📁 Load Progress", type=['json'], key="load_progress")
+    uploaded_file = st.file_uploader("📁 Load Progress", type=PROGRESS_FILE_TYPES, key="load_progress")
     if uploaded_file:
         if st.button("📁 Apply Loaded Data", use_container_width=True):
             try:
-                uploaded_file.seek(0)
-                loaded_data = json.load(uploaded_file)
+                loaded_data = decode_progress(uploaded_file.getvalue())
+            except ValueError as e:
+                st.error(f"Error reading file: {e}")
+            else:
                 # Store in session state and rerun - will be applied at top of page
                 st.session_state['_pending_load_data'] = loaded_data
                 st.rerun()
-            except Exception as e:
-                st.error(f"Error reading file: {e}")
 
 # -------------------------------
 # Summary Stats
@@ -318,8 +297,7 @@ with col2:
     st.metric("Global Discount", f"{global_discount}%")
 
 with col3:
-    custom_count = sum(1 for idx, _ in df.iterrows() if st.session_state.get(f"price_{idx}", "").strip())
-    st.metric("Custom Prices", custom_count)
+    st.metric("Custom Prices", len(get_custom_price_store()))
 
 with col4:
     groups_count = len(group_keys)
@@ -7,7 +7,8 @@ import os
 from utils import (
     initialize_session_state, ensure_dataframe_loaded,
     is_poa_value, get_numeric_price, format_price_display,
-    get_discounted_price, calculate_discount_percent
+    get_discounted_price, calculate_discount_percent,
+    get_session_dataframe, get_custom_price_store, journal_edit
 )
 
 # Initialize session state
@@ -23,7 +24,14 @@ if not ensure_dataframe_loaded():
     st.error("❌ Failed to load equipment data. Please check the Excel file.")
     st.stop()
 
-df = st.session_state['df']
+df = get_session_dataframe()
+store = get_custom_price_store()
+position_of = {idx: position for position, idx in enumerate(df.index)}
+
+def saved_price(idx):
+    """Saved special rate text for a rate card row (by index label)"""
+    return store.get_text(position_of[idx])
+
 global_discount = st.session_state.get('global_discount', 0.0)
 customer_name = st.session_state.get('customer_name', '')
 
@@ -37,8 +45,7 @@ with col1:
 with col2:
     st.info(f"**Global Discount:** {global_discount}%")
 with col3:
-    custom_count = sum(1 for idx, _ in df.iterrows() if st.session_state.get(f"price_{idx}", "").strip())
-    st.info(f"**Custom Prices:** {custom_count}")
+    st.info(f"**Custom Prices:** {len(store)}")
 
 st.markdown("---")
 
@@ -46,12 +53,6 @@ st.markdown("---")
 if 'pending_prices' not in st.session_state:
     st.session_state.pending_prices = {}
 
-# Initialize price keys
-for idx, row in df.iterrows():
-    price_key = f"price_{idx}"
-    if price_key not in st.session_state:
-        st.session_state[price_key] = ""
-
 # Controls
 col_expand, col_collapse, col_legend = st.columns([2, 2, 6])
 
@@ -76,24 +77,24 @@ def pricing_fragment():
     def count_pending_changes():
         count = 0
         for key, pending_val in st.session_state.pending_prices.items():
-            saved_val = st.session_state.get(key, "")
+            saved_val = saved_price(key)
             if pending_val != saved_val:
                 count += 1
         return count
     
-    grouped_df = df.groupby(["GroupName", "Sub Section"])
+    grouped_df = df.groupby(["GroupName", "Sub Section"], observed=True)
     
     for (group, subsection), group_df in grouped_df:
         # Check for custom prices in group
         has_custom_in_group = any(
-            st.session_state.pending_prices.get(f"price_{idx}", st.session_state.get(f"price_{idx}", "")).strip() 
+            st.session_state.pending_prices.get(idx, saved_price(idx)).strip() 
             for idx in group_df.index
         )
         
         has_pending_in_group = any(
-            st.session_state.pending_prices.get(f"price_{idx}", "") != st.session_state.get(f"price_{idx}", "")
+            st.session_state.pending_prices.get(idx, "") != saved_price(idx)
             for idx in group_df.index
-            if f"price_{idx}" in st.session_state.pending_prices
+            if idx in st.session_state.pending_prices
         )
         
         header_text = f"{group} - {subsection}"
@@ -106,12 +107,10 @@ def pricing_fragment():
         
         with st.expander(header_text, expanded=should_expand):
             for idx, row in group_df.iterrows():
-                price_key = f"price_{idx}"
-                saved_value = st.session_state.get(price_key, "")
+                price_key = idx
+                saved_value = saved_price(idx)
                 
                 # Get discounted price
-                discount_key = f"{row['GroupName']}_{row['Sub Section']}_discount"
-                group_discount = st.session_state.get(discount_key, global_discount)
                 discounted_price = get_discounted_price(row, global_discount)
                 
                 col1, col2, col3, col4, col5 = st.columns([2, 3, 1.5, 1.5, 1.5])
@@ -185,23 +184,6 @@ def pricing_fragment():
                             st.markdown("**POA** 📊")
                         else:
                             st.markdown(f"**{discount_percent:.2f}%** 📊")
-                    
-                    # Store final values for export (use SAVED values)
-                    saved_input = saved_value.strip() if saved_value else ""
-                    if saved_input:
-                        if is_poa_value(saved_input):
-                            df.at[idx, "CustomPrice"] = "POA"
-                            df.at[idx, "DiscountPercent"] = "POA"
-                        else:
-                            try:
-                                df.at[idx, "CustomPrice"] = float(saved_input)
-                                df.at[idx, "DiscountPercent"] = calculate_discount_percent(row["HireRateWeekly"], float(saved_input))
-                            except ValueError:
-                                df.at[idx, "CustomPrice"] = "POA"
-                                df.at[idx, "DiscountPercent"] = "POA"
-                    else:
-                        df.at[idx, "CustomPrice"] = discounted_price
-                        df.at[idx, "DiscountPercent"] = calculate_discount_percent(row["HireRateWeekly"], discounted_price)
     
     # Apply/Discard buttons
     st.markdown("---")
@@ -213,10 +195,10 @@ def pricing_fragment():
     with col_apply:
         if st.button(f"✅ Apply Changes ({pending_count})", type="primary", disabled=apply_disabled, use_container_width=True):
             applied = 0
-            for key, value in st.session_state.pending_prices.items():
-                if st.session_state.get(key, "") != value:
-                    st.session_state[key] = value
-                    applied += 1
+            with journal_edit("Apply Changes"):
+                for key, value in st.session_state.pending_prices.items():
+                    if key in position_of and store.set(position_of[key], value):
+                        applied += 1
             st.session_state.pending_prices = {}
             st.success(f"✅ Applied {applied} price change(s)")
             st.rerun()
@@ -230,9 +212,6 @@ def pricing_fragment():
 # Run the pricing fragment
 pricing_fragment()
 
-# Update session state DataFrame
-st.session_state['df'] = df
-
 st.markdown("---")
 
 # -------------------------------
@@ -241,9 +220,8 @@ st.markdown("---")
 st.markdown("### 📋 Manually Entered Custom Prices")
 
 manual_entries = []
-for idx, row in df.iterrows():
-    price_key = f"price_{idx}"
-    user_input = st.session_state.get(price_key, "").strip()
+for position, _, user_input in store.items():
+    row = df.iloc[position]
     
     if user_input:
         if is_poa_value(user_input):
@@ -1,13 +1,19 @@
 # Page 2: Special Rates - Individual Item Pricing (Optimized with data_editor)
 import streamlit as st
 import pandas as pd
+import numpy as np
 
 # Import shared utilities
 from utils import (
     initialize_session_state, ensure_dataframe_loaded,
     is_poa_value, get_numeric_price, format_price_display,
-    get_discounted_price, calculate_discount_percent, add_shared_sidebar,
-    load_conversion_table, parse_erp_data
+    calculate_discount_percent, add_shared_sidebar,
+    load_conversion_table, parse_erp_data, get_session_dataframe,
+    get_custom_price_store, is_valid_custom_price,
+    get_group_discount_vector, get_session_rate_card, get_pricing_fingerprint,
+    format_price_array, search_equipment, fuzzy_search_equipment,
+    journal_edit, get_erp_matcher, parse_erp_file, ERP_FILE_TYPES,
+    process_syrinx_file
 )
 
 # Initialize session state
@@ -26,7 +32,8 @@ if not ensure_dataframe_loaded():
     st.error("❌ Failed to load equipment data. Please check the Excel file.")
     st.stop()
 
-df = st.session_state['df']
+df = get_session_dataframe()
+store = get_custom_price_store()
 global_discount = st.session_state.get('global_discount', 0.0)
 customer_name = st.session_state.get('customer_name', '')
 
@@ -40,104 +47,217 @@ with col1:
 with col2:
     st.info(f"**Global Discount:** {global_discount}%")
 with col3:
-    # Count custom prices from session state
-    custom_count = sum(1 for idx in df.index if st.session_state.get(f"price_{idx}", "").strip())
-    st.info(f"**Custom Prices:** {custom_count}")
+    st.info(f"**Custom Prices:** {len(store)}")
 
 st.markdown("---")
 
 # -------------------------------
 # ERP Import Section
 # -------------------------------
-with st.expander("📥 Import from ERP (Copy & Paste)", expanded=False):
-    st.markdown("""
-    **Instructions:** Copy rate data from your ERP system and paste it below. 
-    The system will automatically match products and calculate prices.
-    
-    - **Fleet products** (01/xxx): Direct code match
-    - **Bulk products** (Bxxxx): Matched by description via conversion table
-    - **Towers** (TOxxx): Per-meter price calculated from height
-    """)
-    
-    # Initialize session state for ERP import
-    if 'erp_paste_data' not in st.session_state:
-        st.session_state.erp_paste_data = ""
-    if 'erp_parsed_results' not in st.session_state:
-        st.session_state.erp_parsed_results = None
-    
-    erp_text = st.text_area(
-        "Paste ERP data here (tab-delimited):",
-        value=st.session_state.erp_paste_data,
-        height=150,
-        placeholder="PAR_EQUIPMENT_CLASS\tEQP_NAME\tPAR_AGREED_WEEK_RATE\t...",
-        key="erp_text_input"
-    )
-    
-    col_parse, col_clear_erp = st.columns([1, 1])
-    
-    with col_parse:
-        if st.button("🔍 Parse & Preview", type="primary", use_container_width=True):
-            if erp_text.strip():
-                st.session_state.erp_paste_data = erp_text
-                conversion_table = load_conversion_table()
-                if conversion_table is not None:
-                    results = parse_erp_data(erp_text, conversion_table, df)
-                    st.session_state.erp_parsed_results = results
-                else:
-                    st.error("❌ Could not load conversion table. Please check the file exists.")
-            else:
-                st.warning("Please paste some data first.")
-    
-    with col_clear_erp:
-        if st.button("🗑️ Clear", use_container_width=True):
-            st.session_state.erp_paste_data = ""
+# Its own fragment: parsing and previewing only rerun this section
+@st.fragment
+def erp_import_section():
+    """ERP paste, parse preview and apply - applying reruns the whole page"""
+    with st.expander("📥 Import from ERP (Copy & Paste or File)", expanded=False):
+        st.markdown("""
+        **Instructions:** Copy rate data from your ERP system and paste it below, or upload an ERP export file. 
+        The system will automatically match products and calculate prices.
+        
+        - **Fleet products** (01/xxx): Direct code match
+        - **Bulk products** (Bxxxx): Matched by description via conversion table
+        - **Towers** (TOxxx): Per-meter price calculated from height
+        """)
+        
+        # Initialize session state for ERP import - only the parsed results are kept, never the raw data
+        if 'erp_parsed_results' not in st.session_state:
             st.session_state.erp_parsed_results = None
-            st.rerun()
-    
-    # Show parsed results
-    if st.session_state.erp_parsed_results:
-        results = st.session_state.erp_parsed_results
+        if 'erp_import_generation' not in st.session_state:
+            st.session_state.erp_import_generation = 0
+        generation = st.session_state.erp_import_generation
+        
+        paste_tab, file_tab = st.tabs(["📋 Paste", "📁 Upload File"])
         
-        matched = [r for r in results if r['status'] == 'matched']
-        unmatched = [r for r in results if r['status'] != 'matched']
+        with paste_tab:
+            erp_text = st.text_area(
+                "Paste ERP data here (tab-delimited):",
+                height=150,
+                placeholder="PAR_EQUIPMENT_CLASS\tEQP_NAME\tPAR_AGREED_WEEK_RATE\t...",
+                key=f"erp_text_input_{generation}"
+            )
+            
+            col_parse, col_clear_erp = st.columns([1, 1])
+            
+            with col_parse:
+                if st.button("🔍 Parse & Preview", type="primary", use_container_width=True):
+                    if erp_text.strip():
+                        conversion_table = load_conversion_table()
+                        if conversion_table is not None:
+                            results = parse_erp_data(erp_text, conversion_table, df, get_erp_matcher())
+                            st.session_state.erp_parsed_results = results
+                        else:
+                            st.error("❌ Could not load conversion table. Please check the file exists.")
+                    else:
+                        st.warning("Please paste some data first.")
+            
+            with col_clear_erp:
+                if st.button("🗑️ Clear", use_container_width=True):
+                    st.session_state.erp_import_generation += 1
+                    st.session_state.erp_parsed_results = None
+                    st.rerun()
         
-        st.markdown(f"### Results: **{len(matched)}** matched, **{len(unmatched)}** unmatched")
+        with file_tab:
+            erp_file = st.file_uploader(
+                "Upload ERP export (TSV, CSV or Excel):",
+                type=ERP_FILE_TYPES,
+                key=f"erp_file_upload_{generation}"
+            )
+            
+            if st.button("🔍 Parse File", type="primary", use_container_width=True, disabled=erp_file is None):
+                if load_conversion_table() is not None:
+                    progress = st.progress(0.0, text=f"Parsing {erp_file.name}...")
+                    try:
+                        results = parse_erp_file(
+                            erp_file, get_erp_matcher(),
+                            lambda fraction: progress.progress(fraction, text=f"Parsing {erp_file.name}... {fraction:.0%}")
+                        )
+                    except Exception as e:
+                        st.error(f"❌ Could not read ERP file: {e}")
+                    else:
+                        # Drop the upload so only the compact results stay in session state
+                        st.session_state.erp_parsed_results = results
+                        st.session_state.erp_import_generation += 1
+                        st.rerun()
+                else:
+                    st.error("❌ Could not load conversion table. Please check the file exists.")
         
-        if matched:
-            st.markdown("#### ✅ Matched Items (will be imported)")
-            matched_df = pd.DataFrame([{
-                'Type': r['product_type'],
-                'ERP Code': r['erp_code'],
-                'Description': r['erp_description'][:50] + '...' if len(r['erp_description']) > 50 else r['erp_description'],
-                'Rate Card Code': r['matched_code'],
-                'ERP Price': f"£{r['erp_price']:.2f}" if r['erp_price'] else '-',
-                'Final Price': f"£{r['final_price']:.2f}" if r['final_price'] else '-',
-                'Note': r['note']
-            } for r in matched])
-            st.dataframe(matched_df, use_container_width=True, hide_index=True, height=300)
+        # Show parsed results
+        if st.session_state.erp_parsed_results:
+            results = st.session_state.erp_parsed_results
+            
+            matched = [r for r in results if r['status'] == 'matched']
+            unmatched = [r for r in results if r['status'] != 'matched']
             
-            if st.button("✅ Apply All Matched Prices", type="primary", use_container_width=True):
-                applied_count = 0
-                for r in matched:
-                    if r['rate_card_idx'] is not None and r['final_price'] is not None:
-                        st.session_state[f"price_{r['rate_card_idx']}"] = str(r['final_price'])
-                        applied_count += 1
+            st.markdown(f"### Results: **{len(matched)}** matched, **{len(unmatched)}** unmatched")
+            
+            if matched:
+                st.markdown("#### ✅ Matched Items (will be imported)")
+                matched_df = pd.DataFrame([{
+                    'Type': r['product_type'],
+                    'ERP Code': r['erp_code'],
+                    'Description': r['erp_description'][:50] + '...' if len(r['erp_description']) > 50 else r['erp_description'],
+                    'Rate Card Code': r['matched_code'],
+                    'ERP Price': f"£{r['erp_price']:.2f}" if r['erp_price'] else '-',
+                    'Final Price': f"£{r['final_price']:.2f}" if r['final_price'] else '-',
+                    'Match': f"{r['match_confidence']:.0%}" if r.get('match_confidence') else '-',
+                    'Note': r['note']
+                } for r in matched])
+                st.dataframe(matched_df, use_container_width=True, hide_index=True, height=300)
+                
+                if st.button("✅ Apply All Matched Prices", type="primary", use_container_width=True):
+                    applied_count = 0
+                    with journal_edit("Apply ERP prices"):
+                        for r in matched:
+                            if r['rate_card_idx'] is not None and r['final_price'] is not None:
+                                store.set_by_code(r['matched_code'], str(r['final_price']))
+                                applied_count += 1
+                    
+                    st.success(f"✅ Applied {applied_count} prices from ERP import!")
+                    st.session_state.erp_parsed_results = None
+                    st.session_state.erp_import_generation += 1
+                    st.rerun()
+            
+            if unmatched:
+                st.markdown("#### ⚠️ Unmatched Items (will be skipped)")
                 
-                st.success(f"✅ Applied {applied_count} prices from ERP import!")
-                st.session_state.erp_parsed_results = None
-                st.session_state.erp_paste_data = ""
+                unmatched_df = pd.DataFrame([{
+                    'Type': r['product_type'] or 'Unknown',
+                    'ERP Code': r['erp_code'],
+                    'Description': r['erp_description'][:50] + '...' if len(r['erp_description']) > 50 else r['erp_description'],
+                    'ERP Price': f"£{r['erp_price']:.2f}" if r['erp_price'] else '-',
+                    'Reason': r['note'],
+                    'Suggested Match': r.get('suggested_match') or '-'
+                } for r in unmatched])
+                st.dataframe(unmatched_df, use_container_width=True, hide_index=True)
+
+erp_import_section()
+
+# -------------------------------
+# Syrinx Import Section
+# -------------------------------
+@st.fragment
+def syrinx_import_section():
+    """Syrinx upload, matched/ignored preview and apply - applying reruns the whole page"""
+    with st.expander("🏢 Import from Syrinx (Excel)", expanded=False):
+        st.markdown("""
+        **Instructions:** Upload a Syrinx Excel file with Category Codes in **Column A** and 
+        Special Prices in **Column B** (no header row). Codes not on the rate card are ignored.
+        """)
+        
+        # Only the matched/ignored preview is kept in session state, not the upload
+        if 'syrinx_preview' not in st.session_state:
+            st.session_state.syrinx_preview = None
+        if 'syrinx_import_generation' not in st.session_state:
+            st.session_state.syrinx_import_generation = 0
+        
+        syrinx_file = st.file_uploader(
+            "📊 Upload Syrinx Excel",
+            type=['xlsx', 'xls'],
+            key=f"syrinx_upload_{st.session_state.syrinx_import_generation}",
+            help="Upload Excel file with Category Codes (Column A) and Special Prices (Column B)"
+        )
+        
+        if st.button("👁️ Preview Import", use_container_width=True, disabled=syrinx_file is None):
+            preview = process_syrinx_file(syrinx_file)
+            if preview is not None:
+                st.session_state.syrinx_preview = preview
+                st.session_state.syrinx_import_generation += 1
                 st.rerun()
         
-        if unmatched:
-            st.markdown("#### ⚠️ Unmatched Items (will be skipped)")
-            unmatched_df = pd.DataFrame([{
-                'Type': r['product_type'] or 'Unknown',
-                'ERP Code': r['erp_code'],
-                'Description': r['erp_description'][:50] + '...' if len(r['erp_description']) > 50 else r['erp_description'],
-                'ERP Price': f"£{r['erp_price']:.2f}" if r['erp_price'] else '-',
-                'Reason': r['note']
-            } for r in unmatched])
-            st.dataframe(unmatched_df, use_container_width=True, hide_index=True)
+        preview = st.session_state.syrinx_preview
+        if preview:
+            matched = preview['matched']
+            ignored = preview['ignored']
+            
+            st.markdown(f"### Results: **{len(matched)}** matched, **{len(ignored)}** ignored "
+                        f"of {preview['total_processed']} rows")
+            
+            if len(matched):
+                st.success(f"✅ {len(matched)} items matched")
+                st.dataframe(pd.DataFrame({
+                    'Code': matched['code'],
+                    'Equipment': matched['equipment'],
+                    'List Price': format_price_array(matched['list_price']),
+                    'Special Price': format_price_array(matched['special_price']),
+                }), use_container_width=True, hide_index=True, height=300)
+            
+            if ignored:
+                st.warning(f"⚠️ {len(ignored)} codes ignored")
+                st.dataframe(pd.DataFrame({'Ignored Code': ignored}), use_container_width=True, hide_index=True, height=200)
+            
+            col_apply, col_cancel = st.columns([1, 1])
+            
+            with col_apply:
+                if st.button("✅ Apply Syrinx Prices", type="primary", use_container_width=True, disabled=not len(matched)):
+                    # Resolved by code now: the rate card version may have changed since the preview
+                    applied_count = 0
+                    with journal_edit("Apply Syrinx prices"):
+                        for code, price in zip(matched['code'], matched['special_price']):
+                            applied_count += store.set_by_code(code, str(price))
+                    
+                    # Toasts survive the rerun below
+                    st.toast(f"✅ Applied {applied_count} prices from Syrinx import!")
+                    if applied_count < len(matched):
+                        st.toast(f"⚠️ {len(matched) - applied_count} codes are no longer on the rate card")
+                    st.session_state.syrinx_preview = None
+                    st.rerun()
+            
+            with col_cancel:
+                if st.button("❌ Cancel Preview", use_container_width=True):
+                    st.session_state.syrinx_preview = None
+                    st.rerun()
+
+syrinx_import_section()
+
 
 # Initialize custom_prices in session state if not exists
 if 'custom_prices_df' not in st.session_state:
@@ -145,146 +265,237 @@ if 'custom_prices_df' not in st.session_state:
 
 # Build editable dataframe
 def build_editable_df():
-    """Build the editable dataframe with current prices"""
-    rows = []
-    current_sub_cat = None
-    shade_toggle = False
+    """Build the editable dataframe with current prices (vectorized over the whole rate card)"""
+    rate_card_index = get_session_rate_card()["index"]
+    is_poa = df["IsPOA"].to_numpy(bool)
+    list_prices = np.where(is_poa, np.nan, df["HireRateWeekly"].to_numpy("float64"))
     
-    for idx, row in df.iterrows():
-        # Toggle shading when sub-category changes
-        if row["Sub Section"] != current_sub_cat:
-            current_sub_cat = row["Sub Section"]
-            shade_toggle = not shade_toggle
-        
-        shade_marker = "🟦" if shade_toggle else "🟨"
-        # Get saved custom price from session state
-        saved_price = st.session_state.get(f"price_{idx}", "")
-        
-        # Calculate discounted price based on group discount
-        discount_key = f"{row['GroupName']}_{row['Sub Section']}_discount"
-        group_discount = st.session_state.get(discount_key, global_discount)
-        
-        if is_poa_value(row["HireRateWeekly"]):
-            original_display = "POA"
-            calculated_price = "POA"
+    # Toggle shading when sub-category changes
+    sub_codes = df["Sub Section"].cat.codes.to_numpy()
+    sub_changes = np.cumsum(np.r_[True, sub_codes[1:] != sub_codes[:-1]]) if len(sub_codes) else sub_codes
+    shade_markers = np.where(sub_changes % 2 == 1, "🟦", "🟨").astype(object)
+    
+    # Calculated price from each row's group discount
+    row_discounts = get_group_discount_vector().effective(global_discount)[rate_card_index["row_group"]]
+    calculated_prices = list_prices * (1 - row_discounts / 100)
+    
+    # Saved special rates and their discount % from the priced rate card (only rows with a special rate)
+    special_rates = np.full(len(df), "", dtype=object)
+    special_discounts = np.full(len(df), "", dtype=object)
+    positions = store.positions()
+    if positions:
+        special_rates[positions] = [store.get_text(position) for position in positions]
+        discount_pcts = df["DiscountPercent"].to_numpy("float64")[positions]
+        special_discounts[positions] = format_price_array(discount_pcts, prefix="", suffix="%", decimals=1)
+    
+    return pd.DataFrame({
+        "▌": shade_markers,  # Visual group indicator
+        "Group": df["GroupName"].astype(str).to_numpy(),
+        "Sub Category": df["Sub Section"].astype(str).to_numpy(),
+        "Category Code": df["ItemCategory"].astype(str).to_numpy(),
+        "Equipment": df["EquipmentName"].to_numpy(),
+        "List Rate": format_price_array(list_prices),
+        "Calculated": format_price_array(calculated_prices),
+        "Special Rate": special_rates,  # Editable column
+        "Discount %": special_discounts,  # Shows discount for saved special rates
+    })
+
+def get_editable_df():
+    """Get the editable dataframe, rebuilt only when the pricing inputs change"""
+    fingerprint = get_pricing_fingerprint(global_discount)
+    cached = st.session_state.get('special_rates_table')
+    if cached is None or cached["fingerprint"] != fingerprint:
+        cached = {"fingerprint": fingerprint, "data": build_editable_df()}
+        st.session_state['special_rates_table'] = cached
+    return cached["data"]
+
+# The editor only shows one window of rows at a time. Edits typed into a
+# window are moved into the pending edits before the window, view or filters
+# change, so edits from every window are kept server-side. Pending edits are
+# keyed by item key (ItemCategory, nth occurrence of the code) so they still
+# land on the right items if the session moves to a new rate card version
+# before they are saved, and rows sharing a code stay apart.
+EDITOR_PAGE_SIZE = 100
+
+if 'special_rate_edits' not in st.session_state:
+    st.session_state['special_rate_edits'] = {}
+if 'editor_generation' not in st.session_state:
+    st.session_state['editor_generation'] = 0
+
+def get_editor_edits():
+    """Get the current editor window's changed cells as {item key: text} (from its edited_rows delta)"""
+    editor_state = st.session_state.get(f"price_editor_{st.session_state['editor_generation']}")
+    item_keys = st.session_state.get('_editor_item_keys')
+    edits = {}
+    if editor_state and item_keys is not None:
+        for row, changes in editor_state.get("edited_rows", {}).items():
+            if "Special Rate" in changes:
+                value = changes["Special Rate"]
+                edits[item_keys[int(row)]] = "" if value is None else str(value)
+    return edits
+
+def get_unsaved_edits():
+    """Get every unsaved special rate edit: pending edits plus the current window's"""
+    return {**st.session_state['special_rate_edits'], **get_editor_edits()}
+
+def capture_editor_edits():
+    """Move edits typed into the current editor window into the pending edits"""
+    st.session_state['special_rate_edits'].update(get_editor_edits())
+    # A fresh editor widget shows the new window with the pending edits merged in
+    st.session_state['editor_generation'] += 1
+
+def jump_to_group():
+    """Capture edits, then show the first window of the chosen group"""
+    capture_editor_edits()
+    window = st.session_state.get('_editor_group_windows', {}).get(st.session_state["editor_jump_group"])
+    if window is not None:
+        st.session_state["editor_window"] = window
+
+# Filters, editor, preview and save controls run as one fragment: typing in a
+# cell or changing a filter only reruns this region. It depends on the rate
+# card view, the custom price store and the global discount, which only change
+# on a full rerun (saving and clearing rerun the whole page).
+@st.fragment
+def special_rates_editor(df, store, global_discount):
+    """Filter, edit, preview and save special rates"""
+    # Filters
+    st.markdown("### 🔍 Filter Items")
+    col_filter1, col_filter2, col_filter3 = st.columns(3)
+    
+    with col_filter1:
+        groups = ["All Groups"] + sorted(df["GroupName"].unique().tolist())
+        selected_group = st.selectbox("Group", groups, key="filter_group", on_change=capture_editor_edits)
+    
+    with col_filter2:
+        if selected_group != "All Groups":
+            categories = ["All Categories"] + sorted(df[df["GroupName"] == selected_group]["ItemCategory"].unique().tolist())
         else:
-            try:
-                original = float(row["HireRateWeekly"])
-                original_display = f"£{original:.2f}"
-                calculated_price = f"£{original * (1 - group_discount/100):.2f}"
-            except:
-                original_display = "POA"
-                calculated_price = "POA"
-        
-        # Calculate discount % for saved special rates
-        special_discount = ""
-        if saved_price and str(saved_price).strip():
-            price_str = str(saved_price).strip()
-            if is_poa_value(price_str):
-                special_discount = "POA"
-            else:
-                try:
-                    special_val = float(price_str)
-                    discount_pct = calculate_discount_percent(row["HireRateWeekly"], special_val)
-                    if discount_pct != "POA":
-                        special_discount = f"{discount_pct:.1f}%"
-                    else:
-                        special_discount = "POA"
-                except:
-                    special_discount = "-"
-        
-        rows.append({
-            "_idx": idx,  # Hidden index for tracking
-            "▌": shade_marker,  # Visual group indicator
-            "Group": row["GroupName"],
-            "Sub Category": row["Sub Section"],
-            "Category Code": row["ItemCategory"],
-            "Equipment": row["EquipmentName"],
-            "List Rate": original_display,
-            "Calculated": calculated_price,
-            "Special Rate": saved_price,  # Editable column
-            "Discount %": special_discount,  # Shows discount for saved special rates
-        })
+            categories = ["All Categories"] + sorted(df["ItemCategory"].unique().tolist())
+        selected_category = st.selectbox("Category", categories, key="filter_category", on_change=capture_editor_edits)
     
-    return pd.DataFrame(rows)
-
-# Filters
-st.markdown("### 🔍 Filter Items")
-col_filter1, col_filter2, col_filter3 = st.columns(3)
-
-with col_filter1:
-    groups = ["All Groups"] + sorted(df["GroupName"].unique().tolist())
-    selected_group = st.selectbox("Group", groups, key="filter_group")
-
-with col_filter2:
+    with col_filter3:
+        search_term = st.text_input(
+            "🔎 Search Equipment", key="search_equipment", placeholder="Type to search...",
+            help="Matches the start of words in the name or code - every word must match (e.g. nav 4.5)",
+            on_change=capture_editor_edits
+        )
+    
+    # Get the (memoized) dataframe and filter it - filtering only slices it
+    edit_df = get_editable_df()
+    
+    # Apply filters (search uses the rate card's inverted index; rows are in position order)
+    fuzzy_matches = False
+    if search_term:
+        positions = search_equipment(search_term)
+        if len(positions) == 0:
+            # Nothing starts with those words - fall back to the closest spellings, best first
+            positions, _ = fuzzy_search_equipment(search_term, limit=25)
+            fuzzy_matches = len(positions) > 0
+        edit_df = edit_df.iloc[positions]
     if selected_group != "All Groups":
-        categories = ["All Categories"] + sorted(df[df["GroupName"] == selected_group]["ItemCategory"].unique().tolist())
+        edit_df = edit_df[edit_df["Group"] == selected_group]
+    if selected_category != "All Categories":
+        edit_df = edit_df[edit_df["Category Code"] == selected_category]
+    
+    st.markdown(f"**Showing {len(edit_df)} of {len(df)} items**")
+    if fuzzy_matches:
+        st.caption(f"No exact matches for '{search_term}' - showing the closest matches instead.")
+    
+    st.markdown("---")
+    
+    # Data editor - fast, efficient editing
+    st.markdown("### ✏️ Edit Special Rates")
+    st.caption("Click on any cell in the 'Special Rate' column to enter a custom price. Leave blank to use the calculated price.")
+    
+    # Split the filtered rows into windows: pages of rows or single sub-sections
+    col_view, col_window, col_jump = st.columns([2, 3, 2])
+    
+    with col_view:
+        view_mode = st.radio(
+            "Show",
+            [f"Pages of {EDITOR_PAGE_SIZE} rows", "One sub-section at a time"],
+            key="editor_view_mode",
+            on_change=capture_editor_edits
+        )
+    
+    windows = {}
+    group_windows = {}
+    if view_mode == "One sub-section at a time":
+        window_keys = list(dict.fromkeys(zip(edit_df["Group"], edit_df["Sub Category"])))
+        for group, subsection in window_keys:
+            label = f"{group} - {subsection}"
+            windows[label] = edit_df[(edit_df["Group"] == group) & (edit_df["Sub Category"] == subsection)]
+            group_windows.setdefault(group, label)
     else:
-        categories = ["All Categories"] + sorted(df["ItemCategory"].unique().tolist())
-    selected_category = st.selectbox("Category", categories, key="filter_category")
-
-with col_filter3:
-    search_term = st.text_input("🔎 Search Equipment", key="search_equipment", placeholder="Type to search...")
-
-# Build and filter the dataframe
-edit_df = build_editable_df()
-
-# Apply filters
-if selected_group != "All Groups":
-    edit_df = edit_df[edit_df["Group"] == selected_group]
-if selected_category != "All Categories":
-    edit_df = edit_df[edit_df["Category Code"] == selected_category]
-if search_term:
-    edit_df = edit_df[edit_df["Equipment"].str.contains(search_term, case=False, na=False)]
-
-st.markdown(f"**Showing {len(edit_df)} of {len(df)} items**")
-
-st.markdown("---")
-
-# Data editor - fast, efficient editing
-st.markdown("### ✏️ Edit Special Rates")
-st.caption("Click on any cell in the 'Special Rate' column to enter a custom price. Leave blank to use the calculated price.")
-
-# Configure column settings
-column_config = {
-    "_idx": None,  # Hide the index column
-    "▌": st.column_config.TextColumn(" ", disabled=True, width=30),  # Visual group indicator
-    "Group": st.column_config.TextColumn("Group", disabled=True, width="small"),
-    "Sub Category": st.column_config.TextColumn("Sub Category", disabled=True, width="small"),
-    "Category Code": st.column_config.TextColumn("Category Code", disabled=True, width="small"),
-    "Equipment": st.column_config.TextColumn("Equipment", disabled=True, width="medium"),
-    "List Rate": st.column_config.TextColumn("List Rate £", disabled=True, width="small"),
-    "Calculated": st.column_config.TextColumn("With Global Discount", disabled=True, width="small"),
-    "Special Rate": st.column_config.TextColumn(
-        "Special Rate",
-        width="small",
-        help="Enter custom price (e.g., 45.00) or POA. Leave blank for calculated price."
-    ),
-    "Discount %": st.column_config.TextColumn("Discount %", disabled=True, width="small"),
-}
-
-# Show the editable data (height for ~30 visible rows)
-edited_df = st.data_editor(
-    edit_df,
-    column_config=column_config,
-    use_container_width=True,
-    hide_index=True,
-    num_rows="fixed",
-    height=735,  # ~20 rows visible (35px per row + header)
-    key="price_editor"
-)
-
-# Show live preview of unsaved edits with calculated discounts
-unsaved_changes = []
-for i in range(len(edit_df)):
-    orig_special = str(edit_df.iloc[i]["Special Rate"]) if pd.notna(edit_df.iloc[i]["Special Rate"]) else ""
-    edit_special = str(edited_df.iloc[i]["Special Rate"]) if pd.notna(edited_df.iloc[i]["Special Rate"]) else ""
+        for start in range(0, len(edit_df), EDITOR_PAGE_SIZE):
+            window_df = edit_df.iloc[start:start + EDITOR_PAGE_SIZE]
+            label = f"Rows {start + 1}-{start + len(window_df)} of {len(edit_df)}"
+            windows[label] = window_df
+            for group in window_df["Group"].unique():
+                group_windows.setdefault(group, label)
+    st.session_state['_editor_group_windows'] = group_windows
     
-    if edit_special.strip() and edit_special != orig_special:
-        # Calculate discount for this unsaved edit
-        idx = edited_df.iloc[i]["_idx"]
-        original_row = df.loc[idx]
-        
+    with col_window:
+        selected_window = st.selectbox(
+            "Window",
+            list(windows) or ["No items"],
+            key="editor_window",
+            on_change=capture_editor_edits
+        )
+    
+    with col_jump:
+        st.selectbox(
+            "Jump to group",
+            list(group_windows),
+            index=None,
+            placeholder="Choose a group...",
+            key="editor_jump_group",
+            on_change=jump_to_group
+        )
+    
+    # Only the selected window goes to the browser, with pending edits from any window merged in
+    window_df = windows.get(selected_window, edit_df.iloc[:0]).copy()
+    pending_edits = st.session_state['special_rate_edits']
+    rate_card_index = get_session_rate_card()["index"]
+    window_item_keys = [rate_card_index["item_keys"][position] for position in window_df.index]  # Index = row position
+    if pending_edits:
+        for row, item_key in enumerate(window_item_keys):
+            if item_key in pending_edits:
+                window_df.iat[row, window_df.columns.get_loc("Special Rate")] = pending_edits[item_key]
+    st.session_state['_editor_item_keys'] = window_item_keys
+    
+    # Configure column settings
+    column_config = {
+        "▌": st.column_config.TextColumn(" ", disabled=True, width=30),  # Visual group indicator
+        "Group": st.column_config.TextColumn("Group", disabled=True, width="small"),
+        "Sub Category": st.column_config.TextColumn("Sub Category", disabled=True, width="small"),
+        "Category Code": st.column_config.TextColumn("Category Code", disabled=True, width="small"),
+        "Equipment": st.column_config.TextColumn("Equipment", disabled=True, width="medium"),
+        "List Rate": st.column_config.TextColumn("List Rate £", disabled=True, width="small"),
+        "Calculated": st.column_config.TextColumn("With Global Discount", disabled=True, width="small"),
+        "Special Rate": st.column_config.TextColumn(
+            "Special Rate",
+            width="small",
+            help="Enter custom price (e.g., 45.00) or POA. Leave blank for calculated price."
+        ),
+        "Discount %": st.column_config.TextColumn("Discount %", disabled=True, width="small"),
+    }
+    
+    # Show the editable window (height for ~20 visible rows)
+    st.data_editor(
+        window_df,
+        column_config=column_config,
+        use_container_width=True,
+        hide_index=True,
+        num_rows="fixed",
+        height=735,  # ~20 rows visible (35px per row + header)
+        key=f"price_editor_{st.session_state['editor_generation']}"
+    )
+    
+    # Show live preview of unsaved edits with calculated discounts
+    def preview_row(position, edit_special):
+        """Build an unsaved-changes preview row for one edited item"""
+        original_row = df.iloc[position]
         if is_poa_value(edit_special):
             calc_discount = "POA"
         else:
@@ -294,53 +505,89 @@ for i in range(len(edit_df)):
                 calc_discount = f"{discount_pct:.1f}%" if discount_pct != "POA" else "POA"
             except:
                 calc_discount = "Invalid"
-        
-        unsaved_changes.append({
-            "Equipment": edited_df.iloc[i]["Equipment"],
+        return {
+            "Equipment": original_row["EquipmentName"],
             "New Special Rate": f"£{edit_special}" if not is_poa_value(edit_special) else "POA",
             "Discount %": calc_discount
-        })
-
-if unsaved_changes:
-    st.markdown("#### ⏳ Unsaved Changes Preview")
-    st.dataframe(pd.DataFrame(unsaved_changes), use_container_width=True, hide_index=True)
-
-# Save changes button
-st.markdown("---")
-
-col_save, col_clear, col_spacer = st.columns([2, 2, 6])
-
-with col_save:
-    if st.button("💾 Update Special Rates", type="primary", use_container_width=True):
-        # Save edited values back to session state
-        saved_count = 0
-        for _, row in edited_df.iterrows():
-            idx = row["_idx"]
-            new_price = str(row["Special Rate"]).strip() if pd.notna(row["Special Rate"]) else ""
-            old_price = st.session_state.get(f"price_{idx}", "")
+        }
+    
+    # Built from the edit deltas only, so the cost follows the number of edits
+    positions_by_item_key = rate_card_index["positions_by_item_key"]
+    unsaved_positions = {
+        positions_by_item_key[item_key]: edit_special
+        for item_key, edit_special in get_unsaved_edits().items()
+        if item_key in positions_by_item_key
+    }
+    unsaved_changes = [
+        preview_row(position, edit_special)
+        for position, edit_special in sorted(unsaved_positions.items())
+        if edit_special.strip() and edit_special != store.get_text(position)
+    ]
+    
+    if unsaved_changes:
+        st.markdown("#### ⏳ Unsaved Changes Preview")
+        st.dataframe(pd.DataFrame(unsaved_changes), use_container_width=True, hide_index=True)
+    
+    # Save changes button
+    st.markdown("---")
+    
+    # Warnings from the last save survive its rerun here
+    for message in st.session_state.pop('special_rates_save_warnings', []):
+        st.warning(message)
+    
+    col_save, col_clear, col_spacer = st.columns([2, 2, 6])
+    
+    with col_save:
+        if st.button("💾 Update Special Rates", type="primary", use_container_width=True):
+            # Apply only the changed cells (edit deltas from every window) to the custom price store
+            unsaved_edits = get_unsaved_edits()
+            saved_count = 0
+            invalid_entries = []
+            still_pending = {}
+            missing_codes = []
+            with journal_edit("Update Special Rates"):
+                for item_key, new_price in unsaved_edits.items():
+                    code = item_key[0]
+                    position = positions_by_item_key.get(item_key)
+                    if position is None:
+                        missing_codes.append(code)  # No longer on this rate card version
+                        continue
+                    if not is_valid_custom_price(new_price):
+                        invalid_entries.append(f"{code}: '{new_price.strip()}'")
+                        still_pending[item_key] = new_price  # Kept so it can be corrected
+                        continue
+                    if store.set(position, new_price.strip()):
+                        saved_count += 1
+            st.session_state['special_rate_edits'] = still_pending
             
-            if new_price != old_price:
-                st.session_state[f"price_{idx}"] = new_price
-                saved_count += 1
-        
-        if saved_count > 0:
-            st.success(f"✅ Saved {saved_count} price change(s)")
-            st.rerun()
-        else:
-            st.info("No changes to save")
+            warnings = []
+            if missing_codes:
+                warnings.append(f"⚠️ Skipped {len(missing_codes)} item(s) no longer on the rate card: {', '.join(missing_codes)}")
+            if invalid_entries:
+                warnings.append(f"⚠️ Skipped {len(invalid_entries)} invalid price(s): {', '.join(invalid_entries)}")
+            if saved_count > 0:
+                st.toast(f"✅ Saved {saved_count} price change(s)")
+                st.session_state['special_rates_save_warnings'] = warnings
+                # Applied - a fresh editor widget shows the saved rates (a no-op save keeps the typed edits)
+                st.session_state['editor_generation'] += 1
+                st.rerun()
+            else:
+                for message in warnings:
+                    st.warning(message)
+                st.info("No changes to save")
+    
+    with col_clear:
+        if st.button("🗑️ Clear All Custom Prices", use_container_width=True):
+            with journal_edit("Clear All Custom Prices"):
+                cleared = store.clear_all()
+            st.session_state['special_rate_edits'] = {}
+            if cleared > 0:
+                st.success(f"✅ Cleared {cleared} custom price(s)")
+                st.rerun()
+            else:
+                st.info("No custom prices to clear")
 
-with col_clear:
-    if st.button("🗑️ Clear All Custom Prices", use_container_width=True):
-        cleared = 0
-        for idx in df.index:
-            if st.session_state.get(f"price_{idx}", ""):
-                st.session_state[f"price_{idx}"] = ""
-                cleared += 1
-        if cleared > 0:
-            st.success(f"✅ Cleared {cleared} custom price(s)")
-            st.rerun()
-        else:
-            st.info("No custom prices to clear")
+special_rates_editor(df, store, global_discount)
 
 # Summary of custom prices
 st.markdown("---")
@@ -348,8 +595,8 @@ st.markdown("### 📋 Custom Prices Summary")
 
 # Build summary of non-empty custom prices
 summary_rows = []
-for idx, row in df.iterrows():
-    custom_price = st.session_state.get(f"price_{idx}", "").strip()
+for position, _, custom_price in store.items():
+    row = df.iloc[position]
     if custom_price:
         if is_poa_value(custom_price):
             discount_display = "POA"
@@ -358,8 +605,8 @@ for idx, row in df.iterrows():
             try:
                 price_val = float(custom_price)
                 price_display = f"£{price_val:.2f}"
-                discount_pct = calculate_discount_percent(row["HireRateWeekly"], price_val)
-                discount_display = f"{discount_pct:.2f}%" if discount_pct != "POA" else "POA"
+                discount_pct = row["DiscountPercent"]  # From the shared priced rate card
+                discount_display = "POA" if pd.isna(discount_pct) else f"{discount_pct:.2f}%"
             except:
                 price_display = custom_price
                 discount_display = "Invalid"
@@ -379,33 +626,6 @@ if summary_rows:
 else:
     st.info("No custom prices set. Edit the 'Special Rate' column above to add custom prices.")
 
-# Update the main dataframe with custom prices for export
-for idx, row in df.iterrows():
-    custom_price = st.session_state.get(f"price_{idx}", "").strip()
-    
-    if custom_price:
-        if is_poa_value(custom_price):
-            df.at[idx, "CustomPrice"] = "POA"
-            df.at[idx, "DiscountPercent"] = "POA"
-        else:
-            try:
-                price_val = float(custom_price)
-                df.at[idx, "CustomPrice"] = price_val
-                df.at[idx, "DiscountPercent"] = calculate_discount_percent(row["HireRateWeekly"], price_val)
-            except:
-                df.at[idx, "CustomPrice"] = "POA"
-                df.at[idx, "DiscountPercent"] = "POA"
-    else:
-        # Use calculated price
-        discount_key = f"{row['GroupName']}_{row['Sub Section']}_discount"
-        group_discount = st.session_state.get(discount_key, global_discount)
-        discounted = get_discounted_price(row, group_discount)
-        df.at[idx, "CustomPrice"] = discounted
-        df.at[idx, "DiscountPercent"] = calculate_discount_percent(row["HireRateWeekly"], discounted)
-
-# Save updated df back to session state
-st.session_state['df'] = df
-
 # Navigation hint
 st.markdown("---")
 st.info("👉 **Next:** Go to **Export** page to download Excel, PDF, or email the price list.")
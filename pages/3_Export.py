@@ -1,19 +1,17 @@
 # Page 3: Export - Generate and Download Files
 import streamlit as st
-import pandas as pd
 import io
 import os
-import json
 
 # Import shared utilities (Streamlit runs from project root)
 from utils import (
     initialize_session_state, ensure_dataframe_loaded, get_uk_time,
-    format_price_display, format_price_for_export, format_custom_price_for_export,
-    format_discount_for_export, format_custom_price_for_display,
-    create_admin_dataframe, create_transport_dataframe, create_save_data,
+    format_price_for_export, format_custom_price_for_export,
+    create_admin_dataframe, create_transport_dataframe, get_progress_download,
     TRANSPORT_TYPES, DEFAULT_TRANSPORT_CHARGES, SCRIPT_DIR,
-    SENDGRID_API_KEY, SENDGRID_FROM_EMAIL, is_poa_value, calculate_discount_percent,
-    generate_customer_pdf, add_shared_sidebar
+    SENDGRID_API_KEY, SENDGRID_FROM_EMAIL,
+    generate_customer_pdf, add_shared_sidebar, get_session_dataframe,
+    format_price_array, get_custom_price_store, create_admin_workbook
 )
 
 # Initialize session state
@@ -32,7 +30,7 @@ if not ensure_dataframe_loaded():
     st.error("❌ Failed to load equipment data. Please check the Excel file.")
     st.stop()
 
-df = st.session_state['df']
+df = get_session_dataframe()
 customer_name = st.session_state.get('customer_name', '')
 global_discount = st.session_state.get('global_discount', 0.0)
 
@@ -49,8 +47,7 @@ with col1:
 with col2:
     st.info(f"**Global Discount:** {global_discount}%")
 with col3:
-    custom_count = sum(1 for idx, _ in df.iterrows() if st.session_state.get(f"price_{idx}", "").strip())
-    st.info(f"**Custom Prices:** {custom_count}")
+    st.info(f"**Custom Prices:** {len(get_custom_price_store())}")
 
 if not customer_name:
     st.error("⚠️ Please enter a customer name on the **Discounts** page before exporting.")
@@ -58,40 +55,6 @@ if not customer_name:
 
 st.markdown("---")
 
-# Update CustomPrice and DiscountPercent in DataFrame from session state
-for idx, row in df.iterrows():
-    price_key = f"price_{idx}"
-    user_input = st.session_state.get(price_key, "").strip()
-    
-    if user_input:
-        if is_poa_value(user_input):
-            df.at[idx, "CustomPrice"] = "POA"
-            df.at[idx, "DiscountPercent"] = "POA"
-        else:
-            try:
-                df.at[idx, "CustomPrice"] = float(user_input)
-                df.at[idx, "DiscountPercent"] = calculate_discount_percent(row["HireRateWeekly"], float(user_input))
-            except ValueError:
-                df.at[idx, "CustomPrice"] = "POA"
-                df.at[idx, "DiscountPercent"] = "POA"
-    else:
-        # Use calculated price based on group discount
-        discount_key = f"{row['GroupName']}_{row['Sub Section']}_discount"
-        discount = st.session_state.get(discount_key, global_discount)
-        
-        if is_poa_value(row["HireRateWeekly"]):
-            df.at[idx, "CustomPrice"] = "POA"
-            df.at[idx, "DiscountPercent"] = "POA"
-        else:
-            try:
-                original = float(row["HireRateWeekly"])
-                discounted = original * (1 - discount / 100)
-                df.at[idx, "CustomPrice"] = discounted
-                df.at[idx, "DiscountPercent"] = discount
-            except (ValueError, TypeError):
-                df.at[idx, "CustomPrice"] = "POA"
-                df.at[idx, "DiscountPercent"] = "POA"
-
 # Create export DataFrames
 admin_df = create_admin_dataframe(df, customer_name)
 transport_df = create_transport_dataframe()
@@ -121,23 +84,9 @@ col1, col2, col3 = st.columns(3)
 with col1:
     st.markdown("#### 📊 Excel (Admin)")
     
-    output_excel = io.BytesIO()
-    with pd.ExcelWriter(output_excel, engine='openpyxl') as writer:
-        admin_df.to_excel(writer, sheet_name='Price List', index=False)
-        transport_df.to_excel(writer, sheet_name='Transport Charges', index=False)
-        
-        summary_data = {
-            'Customer': [customer_name],
-            'Total Items': [len(admin_df)],
-            'Global Discount %': [global_discount],
-            'Date Created': [get_uk_time().strftime("%Y-%m-%d %H:%M")],
-            'Created By': ['Net Rates Calculator']
-        }
-        pd.DataFrame(summary_data).to_excel(writer, sheet_name='Summary', index=False)
-    
     st.download_button(
         label="📊 Download Excel",
-        data=output_excel.getvalue(),
+        data=create_admin_workbook(admin_df, transport_df, customer_name, global_discount),
         file_name=f"{customer_name}_admin_pricelist_{get_uk_time().strftime('%Y%m%d')}.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         use_container_width=True
@@ -158,13 +107,11 @@ with col2:
 with col3:
     st.markdown("#### 💾 JSON (Backup)")
     
-    save_data = create_save_data(customer_name, df)
-    json_data = json.dumps(save_data, indent=2)
     timestamp = get_uk_time().strftime("%Y-%m-%d_%H-%M-%S")
     
     st.download_button(
         label="💾 Download JSON",
-        data=json_data,
+        data=get_progress_download(customer_name, df, compress=False),
         file_name=f"{customer_name}_progress_{timestamp}.json",
         mime="application/json",
         use_container_width=True
@@ -310,9 +257,9 @@ display_df = df[[
     "GroupName", "Sub Section", "CustomPrice", "DiscountPercent"
 ]].copy()
 
-display_df["HireRateWeekly"] = display_df["HireRateWeekly"].apply(format_price_display)
-display_df["CustomPrice"] = display_df["CustomPrice"].apply(format_custom_price_for_display)
-display_df["DiscountPercent"] = display_df["DiscountPercent"].apply(format_discount_for_export)
+display_df["HireRateWeekly"] = format_price_array(display_df["HireRateWeekly"])
+display_df["CustomPrice"] = format_price_array(display_df["CustomPrice"])
+display_df["DiscountPercent"] = format_price_array(display_df["DiscountPercent"], prefix="", suffix="%")
 
 display_df.columns = ["Category", "Equipment", "Original", "Group", "Sub Section", "Final Price", "Discount %"]
 
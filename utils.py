@@ -3,9 +3,21 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
 import json
+import gzip
+import zlib
 import os
+import hashlib
+import pickle
+import re
+import bisect
+import csv
+from itertools import islice
+from contextlib import contextmanager
+import threading
+import time
 from datetime import datetime
 import fitz  # PyMuPDF
 from PIL import Image
@@ -98,24 +110,24 @@ def save_config(config):
 # -------------------------------
 CONVERSION_TABLE_FILE = os.path.join(SCRIPT_DIR, "Conversion Table for Net Rates App.xlsx")
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes
 def load_conversion_table():
-    """Load the ERP conversion table from Excel file"""
+    """Get the current ERP conversion table (kept up to date by the source watcher)"""
     try:
         if os.path.exists(CONVERSION_TABLE_FILE):
-            df = pd.read_excel(CONVERSION_TABLE_FILE)
-            return df
+            return get_current_source("conversion_table")["data"]
         else:
             return None
     except Exception as e:
         st.error(f"Error loading conversion table: {e}")
         return None
 
+TOWER_HEIGHT_PATTERN = r'H(\d+\.?\d*)x'
+
 def extract_tower_height(description):
     """Extract height value from tower description (e.g., 'H2.66xL2.0m' -> 2.66)"""
     import re
     # Match pattern like H2.66x or H2.66xL
-    match = re.search(r'H(\d+\.?\d*)x', description, re.IGNORECASE)
+    match = re.search(TOWER_HEIGHT_PATTERN, description, re.IGNORECASE)
     if match:
         try:
             return float(match.group(1))
@@ -123,10 +135,158 @@ def extract_tower_height(description):
             return None
     return None
 
-def parse_erp_data(erp_text, conversion_table, rate_card_df):
+# Bulk/Tower descriptions that miss the exact lookup fall back to a fuzzy match:
+# a normalized key first (case, punctuation, "2.0m" vs "2 m"), then the closest
+# description by n-gram overlap (Dice). Only matches at or above the threshold
+# are applied automatically - the rest are left for the estimator.
+ERP_FUZZY_AUTO_ACCEPT = 0.85
+ERP_FUZZY_PENALTY = 0.5  # Confidence factor for different dimensions ("H4.53xL2.5m" vs "H6.53xL2.5m") or a near tie
+ERP_FUZZY_MIN_MARGIN = 0.05  # Best entry must beat the runner-up by this much
+ERP_UNITS = r"mm|cm|m|kg|t|kva|kw|v|ft|ltr|l"
+
+def normalize_erp_description(description):
+    """Normalize an ERP/conversion description for matching (e.g., 'H2.0 m Tower,' -> 'h2m tower')"""
+    text = str(description).lower()
+    text = re.sub(r"\d+\.\d+", lambda m: m.group().rstrip("0").rstrip("."), text)  # 2.50 -> 2.5, 2.0 -> 2
+    text = re.sub(r"[^a-z0-9.]+", " ", text)
+    text = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", text)  # Keep only decimal points
+    text = re.sub(rf"(\d) ({ERP_UNITS})\b", r"\1\2", text)
+    return " ".join(text.split())
+
+def get_description_numbers(normalized):
+    """The numbers of a normalized description in order (its dimensions)"""
+    return " ".join(re.findall(r"\d+(?:\.\d+)?", normalized))
+
+def compile_erp_matcher(conversion_table, rate_card_df, rate_card_index=None,
+                        rate_card_trigrams=None, conversion_trigrams=None):
+    """Compile the conversion table and rate card lookups used to match ERP lines
+    
+    The index and trigram arguments are the ones already built for the source
+    entries (see refresh_source); they are built here when not passed.
+    """
+    codes = conversion_table['EQP_EQUIPMENT_CLASS'].astype(str).str.strip()
+    names = conversion_table['EQP_NAME'].astype(str)
+    descriptions = names.str.strip().str.lower()
+    product_types = conversion_table['Type'].astype(str).str.strip()
+    
+    if rate_card_index is None:
+        rate_card_index = build_rate_card_index(rate_card_df)
+    if rate_card_trigrams is None:
+        rate_card_trigrams = build_trigram_index(rate_card_df["EquipmentName"].astype(str) + " " + rate_card_df["ItemCategory"].astype(str))
+    if conversion_trigrams is None:
+        conversion_trigrams = build_trigram_index(names)
+    
+    is_bulk = product_types == 'Bulk'
+    is_tower = product_types == 'Tower'
+    is_fuzzy = is_bulk | is_tower
+    fuzzy_types = product_types[is_fuzzy].to_numpy()
+    fuzzy_keys = conversion_table['EQP_NAME'][is_fuzzy].astype(str).map(normalize_erp_description)
+    return {
+        # For Fleet: code -> code (direct match)
+        "fleet_codes": set(codes[product_types == 'Fleet']),
+        # For Bulk/Tower: description -> code (last entry wins, as before)
+        "bulk_desc_to_code": dict(zip(descriptions[is_bulk], codes[is_bulk])),
+        "tower_desc_to_code": dict(zip(descriptions[is_tower], codes[is_tower])),
+        # For Bulk/Tower near misses: (type, normalized description) -> entry, plus n-grams of the entries
+        "fuzzy_keys": {key: position for position, key in enumerate(zip(fuzzy_types, fuzzy_keys))},
+        "fuzzy_trigrams": build_trigram_index(fuzzy_keys),
+        "fuzzy_candidates": {product_type: fuzzy_types == product_type for product_type in ('Bulk', 'Tower')},
+        "fuzzy_numbers": fuzzy_keys.map(get_description_numbers).to_numpy(),
+        "fuzzy_codes": codes[is_fuzzy].to_numpy(),
+        "fuzzy_names": conversion_table['EQP_NAME'][is_fuzzy].astype(str).str.strip().to_numpy(),
+        # For suggestions on unmatched lines: closest whole conversion entry or rate card item
+        "conversion_trigrams": conversion_trigrams,
+        "conversion_types": product_types.to_numpy(),
+        "conversion_codes": codes.to_numpy(),
+        "conversion_names": names.str.strip().to_numpy(),
+        "rate_card_trigrams": rate_card_trigrams,
+        "rate_card_codes": rate_card_index["codes"],
+        # Rate card lookup by ItemCategory (code -> row position)
+        "positions_by_code": rate_card_index["positions_by_code"],
+        "rate_card_names": rate_card_index["names"],
+        "rate_card_labels": rate_card_df.index,
+    }
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _get_cached_erp_matcher(conversion_version, rate_card_version):
+    conversion = get_source_entry("conversion_table", conversion_version)
+    rate_card = get_source_entry("rate_card", rate_card_version)
+    if conversion is None or rate_card is None:
+        return None  # Version already dropped - caller compiles without caching
+    return compile_erp_matcher(
+        conversion["data"], rate_card["data"], rate_card["index"], rate_card["trigrams"], conversion["trigrams"]
+    )
+
+def get_erp_matcher():
+    """Get the ERP matcher for the current conversion table and this session's rate card (compiled once per pair of versions)"""
+    conversion = get_current_source("conversion_table")
+    rate_card = get_session_rate_card()
+    matcher = _get_cached_erp_matcher(conversion["version"], rate_card["version"])
+    if matcher is None:
+        matcher = compile_erp_matcher(
+            conversion["data"], rate_card["data"], rate_card["index"], rate_card["trigrams"], conversion["trigrams"]
+        )
+    return matcher
+
+def match_erp_description(matcher, description, product_type):
+    """
+    Find the closest Bulk/Tower conversion entry for a description.
+    
+    Returns:
+        (code, conversion table name, confidence 0-1), or (None, None, 0.0) if nothing is close
+    """
+    key = normalize_erp_description(description)
+    position = matcher["fuzzy_keys"].get((product_type, key))
+    if position is not None:
+        return matcher["fuzzy_codes"][position], matcher["fuzzy_names"][position], 1.0
+    
+    index = matcher["fuzzy_trigrams"]
+    query = get_trigrams(key)
+    postings = [index["postings"][t] for t in query if t in index["postings"]]
+    if not postings or product_type not in matcher["fuzzy_candidates"]:
+        return None, None, 0.0
+    shared = np.bincount(np.concatenate(postings), minlength=len(index["sizes"]))
+    confidence = 2 * shared / (len(query) + index["sizes"])
+    confidence = np.where(matcher["fuzzy_numbers"] == get_description_numbers(key), confidence, confidence * ERP_FUZZY_PENALTY)
+    confidence = np.where(matcher["fuzzy_candidates"][product_type], confidence, 0.0)
+    position = int(np.argmax(confidence))
+    if confidence[position] == 0:
+        return None, None, 0.0
+    # A near tie with another entry ("W GRP Tower" vs SW/DW) is a guess, not a match
+    runner_up = np.partition(confidence, -2)[-2] if len(confidence) > 1 else 0.0
+    if confidence[position] - runner_up < ERP_FUZZY_MIN_MARGIN:
+        confidence[position] *= ERP_FUZZY_PENALTY
+    return matcher["fuzzy_codes"][position], matcher["fuzzy_names"][position], float(confidence[position])
+
+def suggest_erp_match(matcher, description, product_type):
+    """Closest conversion table entry (Bulk/Tower) or rate card item for an unmatched ERP line, as display text (None if nothing is close)"""
+    if not description:
+        return None
+    if product_type in ('Bulk', 'Tower'):
+        code, name, confidence = match_erp_description(matcher, description, product_type)
+        if confidence >= FUZZY_MIN_SIMILARITY:
+            return f"{code} - {name} ({confidence:.0%})"
+        # Nothing close as a whole - fall back to the entry sharing most of the description
+        positions, scores = trigram_search(
+            matcher["conversion_trigrams"], description, limit=1, candidates=matcher["conversion_types"] == product_type
+        )
+        if len(positions):
+            position = positions[0]
+            return f"{matcher['conversion_codes'][position]} - {matcher['conversion_names'][position]} ({scores[0]:.0%})"
+    else:
+        positions, scores = trigram_search(matcher["rate_card_trigrams"], description, limit=1)
+        if len(positions):
+            position = positions[0]
+            return f"{matcher['rate_card_codes'][position]} - {matcher['rate_card_names'][position]} ({scores[0]:.0%})"
+    return None
+
+def parse_erp_data(erp_text, conversion_table, rate_card_df, matcher=None):
     """
     Parse ERP copy-paste data and match against conversion table and rate card.
     
+    Pass a compiled matcher (see get_erp_matcher) to avoid rebuilding the
+    conversion table and rate card lookups on every call.
+    
     Returns a list of dicts with:
     - erp_code: Original ERP code
     - erp_description: ERP description
@@ -138,6 +298,8 @@ def parse_erp_data(erp_text, conversion_table, rate_card_df):
     - product_type: Fleet/Bulk/Tower
     - status: matched/unmatched/error
     - note: Any notes about the match
+    - match_confidence: 1.0 for exact matches, below 1.0 for near misses (None if unmatched)
+    - suggested_match: closest entry for unmatched lines, as display text (None if matched or nothing is close)
     """
     results = []
     
@@ -147,150 +309,273 @@ def parse_erp_data(erp_text, conversion_table, rate_card_df):
     if conversion_table is None:
         return [{"status": "error", "note": "Conversion table not loaded"}]
     
-    # Build lookup dictionaries from conversion table
-    # For Fleet: code -> code (direct match)
-    # For Bulk/Tower: description -> code
-    fleet_codes = set()
-    bulk_desc_to_code = {}
-    tower_desc_to_code = {}
-    
-    for _, row in conversion_table.iterrows():
-        code = str(row['EQP_EQUIPMENT_CLASS']).strip()
-        desc = str(row['EQP_NAME']).strip().lower()
-        prod_type = str(row['Type']).strip()
-        
-        if prod_type == 'Fleet':
-            fleet_codes.add(code)
-        elif prod_type == 'Bulk':
-            bulk_desc_to_code[desc] = code
-        elif prod_type == 'Tower':
-            tower_desc_to_code[desc] = code
-    
-    # Build rate card lookup by ItemCategory
-    rate_card_lookup = {}
-    for idx, row in rate_card_df.iterrows():
-        item_cat = str(row['ItemCategory']).strip()
-        rate_card_lookup[item_cat] = {
-            'idx': idx,
-            'name': row['EquipmentName'],
-            'price': row['HireRateWeekly']
-        }
+    if matcher is None:
+        matcher = compile_erp_matcher(conversion_table, rate_card_df)
     
-    # Parse ERP data (tab-delimited)
-    lines = erp_text.strip().split('\n')
+    # Parse ERP data (tab-delimited) - all lines at once
+    return match_erp_rows(split_erp_lines(erp_text.strip().split('\n')), matcher)
+
+ERP_MIN_COLUMNS = 7
+
+def split_erp_lines(lines):
+    """Split tab-delimited ERP lines into a frame of text columns, dropping blank and short lines"""
+    lines = pd.Series(lines, dtype=object)
+    lines = lines[(lines.str.strip() != "") & (lines.str.count('\t') >= ERP_MIN_COLUMNS - 1)]
+    if lines.empty:
+        return pd.DataFrame(columns=range(ERP_MIN_COLUMNS), dtype=object)
+    return lines.str.split('\t', expand=True)
+
+def match_erp_rows(rows, matcher):
+    """
+    Match a frame of ERP columns against the compiled lookups in one vectorized pass.
     
-    for line in lines:
-        if not line.strip():
-            continue
-        
-        # Split by tab
-        parts = line.split('\t')
-        
-        if len(parts) < 7:
-            continue
-        
-        erp_code = parts[0].strip()
-        erp_desc_col2 = parts[1].strip() if len(parts) > 1 else ""  # Sometimes description is in col 2
-        erp_price_raw = parts[2].strip() if len(parts) > 2 else ""  # Week rate in col 3
-        erp_desc_col7 = parts[6].strip() if len(parts) > 6 else ""  # Main description in col 7
-        
-        # Use column 7 description if available, otherwise column 2
-        erp_description = erp_desc_col7 if erp_desc_col7 else erp_desc_col2
-        
-        # Skip header row
-        if erp_code == 'PAR_EQUIPMENT_CLASS' or 'EQC_NAME' in erp_description:
-            continue
-        
-        # Parse price (remove £ symbol)
-        erp_price = None
-        if erp_price_raw:
-            try:
-                erp_price = float(erp_price_raw.replace('£', '').replace(',', '').strip())
-            except ValueError:
-                pass
-        
-        result = {
-            'erp_code': erp_code,
-            'erp_description': erp_description,
-            'erp_price': erp_price,
-            'matched_code': None,
-            'matched_name': None,
-            'rate_card_idx': None,
-            'final_price': None,
-            'product_type': None,
-            'status': 'unmatched',
-            'note': ''
+    Columns are positional: 0 = equipment class code, 1 = name, 2 = week rate,
+    6 = description. Returns the same list of result dicts as parse_erp_data.
+    """
+    def column(i):
+        if i not in rows.columns:
+            return pd.Series("", index=rows.index, dtype=object)
+        return rows[i].fillna("").astype(str).str.strip()
+    
+    erp_code = column(0)
+    erp_desc_col2 = column(1)  # Sometimes description is in col 2
+    erp_price_raw = column(2)  # Week rate in col 3
+    erp_desc_col7 = column(6)  # Main description in col 7
+    
+    # Use column 7 description if available, otherwise column 2
+    erp_description = erp_desc_col7.where(erp_desc_col7 != "", erp_desc_col2)
+    
+    # Skip header rows
+    keep = ~((erp_code == 'PAR_EQUIPMENT_CLASS') | erp_description.str.contains('EQC_NAME', regex=False))
+    erp_code, erp_description, erp_price_raw = erp_code[keep], erp_description[keep], erp_price_raw[keep]
+    if erp_code.empty:
+        return []
+    
+    # Parse prices (remove £ symbol and thousands separators)
+    erp_price = pd.to_numeric(
+        erp_price_raw.str.replace('£', '', regex=False).str.replace(',', '', regex=False).str.strip(),
+        errors='coerce'
+    ).to_numpy("float64")
+    
+    # Determine product types
+    is_fleet = (erp_code.str[:1].str.isdigit() & erp_code.str.contains('/', regex=False)).to_numpy()
+    is_bulk = ~is_fleet & erp_code.str.startswith('B').to_numpy()
+    is_tower = ~is_fleet & ~is_bulk & erp_code.str.startswith('TO').to_numpy()
+    
+    # Join: Fleet codes directly, Bulk/Tower descriptions through the conversion table
+    desc_lower = erp_description.str.lower().str.strip()
+    converted = pd.Series(None, index=erp_code.index, dtype=object)
+    converted[is_fleet] = erp_code[is_fleet]
+    converted[is_bulk] = desc_lower[is_bulk].map(matcher["bulk_desc_to_code"])
+    converted[is_tower] = desc_lower[is_tower].map(matcher["tower_desc_to_code"])
+    
+    # Near misses: take the closest conversion entry only when it is confident enough
+    # (once per distinct description - exports repeat the same lines)
+    match_confidence = np.where(converted.notna().to_numpy(), 1.0, np.nan)
+    product_type = np.full(len(erp_code), None, dtype=object)
+    product_type[is_fleet] = 'Fleet'
+    product_type[is_bulk] = 'Bulk'
+    product_type[is_tower] = 'Tower'
+    descriptions = erp_description.to_numpy(dtype=object)
+    fuzzy_names = {}
+    fuzzy_matches = {}
+    for i in np.flatnonzero((is_bulk | is_tower) & converted.isna().to_numpy()):
+        key = (descriptions[i], product_type[i])
+        if key not in fuzzy_matches:
+            fuzzy_matches[key] = match_erp_description(matcher, *key)
+        code, name, confidence = fuzzy_matches[key]
+        if code is not None and confidence >= ERP_FUZZY_AUTO_ACCEPT:
+            converted.iloc[i] = code
+            match_confidence[i] = confidence
+            fuzzy_names[i] = name
+    
+    positions = converted.map(matcher["positions_by_code"]).to_numpy()
+    has_conversion = converted.notna().to_numpy()
+    is_matched = has_conversion & pd.notna(positions)
+    matched_positions = positions[is_matched].astype(int)
+    
+    def column(values=None):
+        return np.full(len(erp_code), values, dtype=object)
+    
+    price = column()
+    price[~np.isnan(erp_price)] = erp_price[~np.isnan(erp_price)].tolist()
+    matched_code, matched_name, rate_card_idx, final_price, confidence = column(), column(), column(), column(), column()
+    matched_code[is_matched] = converted[is_matched].to_numpy()
+    matched_name[is_matched] = matcher["rate_card_names"][matched_positions]
+    rate_card_idx[is_matched] = matcher["rate_card_labels"][matched_positions].tolist()
+    final_price[is_matched] = price[is_matched]
+    confidence[is_matched] = match_confidence[is_matched].tolist()
+    
+    # Notes explain why a line is unmatched
+    note = column('')
+    unmatched = ~is_matched
+    not_converted = unmatched & ~has_conversion
+    note[is_fleet & unmatched] = ("Code " + erp_code[is_fleet & unmatched] + " not found in rate card").to_numpy()
+    note[is_bulk & not_converted] = "Description not found in conversion table"
+    note[is_tower & not_converted] = "Tower description not found in conversion table"
+    not_on_card = (is_bulk | is_tower) & unmatched & has_conversion
+    note[not_on_card] = ("Converted code " + converted[not_on_card] + " not in rate card").to_numpy()
+    unknown = ~(is_fleet | is_bulk | is_tower)
+    note[unknown] = ("Unknown product type for code: " + erp_code[unknown]).to_numpy()
+    
+    # Per-meter price for matched towers from the tower height
+    matched_towers = np.flatnonzero(is_tower & is_matched)
+    if len(matched_towers):
+        heights = erp_description.iloc[matched_towers].str.extract(TOWER_HEIGHT_PATTERN, flags=re.IGNORECASE)[0].astype(float)
+        for i, height in zip(matched_towers, heights.tolist()):
+            height = None if np.isnan(height) else height
+            if height and height > 0 and price[i]:
+                final_price[i] = round(price[i] / height, 2)
+                note[i] = f"£{price[i]:.2f} ÷ {height}m = £{final_price[i]:.2f}/m"
+            elif not height:
+                note[i] = "Could not extract height for per-meter calc"
+    
+    for i, name in fuzzy_names.items():
+        fuzzy_note = f"Closest conversion entry '{name}' ({match_confidence[i]:.0%})"
+        note[i] = f"{fuzzy_note}; {note[i]}" if note[i] else fuzzy_note
+    
+    # Worked out once here (per distinct description), so the unmatched table only renders it
+    suggested_match = column()
+    suggestions = {}
+    for i in np.flatnonzero(unmatched):
+        key = (descriptions[i], product_type[i])
+        if key not in suggestions:
+            suggestions[key] = suggest_erp_match(matcher, *key)
+        suggested_match[i] = suggestions[key]
+    
+    # One pass over plain lists - DataFrame.to_dict("records") boxes every cell and is several times slower
+    columns = zip(*(values.tolist() for values in (
+        erp_code.to_numpy(dtype=object), descriptions, price, matched_code, matched_name, rate_card_idx,
+        final_price, product_type, np.where(is_matched, 'matched', 'unmatched'), note, confidence, suggested_match,
+    )))
+    return [
+        {
+            'erp_code': code,
+            'erp_description': description,
+            'erp_price': price_value,
+            'matched_code': matched,
+            'matched_name': name,
+            'rate_card_idx': label,
+            'final_price': final,
+            'product_type': kind,
+            'status': status,
+            'note': text,
+            'match_confidence': match,
+            'suggested_match': suggestion,
         }
-        
-        # Determine product type and match
-        if erp_code and erp_code[0].isdigit() and '/' in erp_code:
-            # Fleet product - direct code match
-            result['product_type'] = 'Fleet'
-            
-            if erp_code in rate_card_lookup:
-                result['matched_code'] = erp_code
-                result['matched_name'] = rate_card_lookup[erp_code]['name']
-                result['rate_card_idx'] = rate_card_lookup[erp_code]['idx']
-                result['final_price'] = erp_price
-                result['status'] = 'matched'
-            else:
-                result['note'] = f"Code {erp_code} not found in rate card"
-        
-        elif erp_code.startswith('B') or erp_code.startswith('BNHOL'):
-            # Bulk product - match by description
-            result['product_type'] = 'Bulk'
-            
-            desc_lower = erp_description.lower().strip()
-            if desc_lower in bulk_desc_to_code:
-                matched_code = bulk_desc_to_code[desc_lower]
-                if matched_code in rate_card_lookup:
-                    result['matched_code'] = matched_code
-                    result['matched_name'] = rate_card_lookup[matched_code]['name']
-                    result['rate_card_idx'] = rate_card_lookup[matched_code]['idx']
-                    result['final_price'] = erp_price
-                    result['status'] = 'matched'
-                else:
-                    result['note'] = f"Converted code {matched_code} not in rate card"
-            else:
-                result['note'] = f"Description not found in conversion table"
-        
-        elif erp_code.startswith('TO'):
-            # Tower product - match by description and calculate per-meter price
-            result['product_type'] = 'Tower'
-            
-            desc_lower = erp_description.lower().strip()
-            if desc_lower in tower_desc_to_code:
-                matched_code = tower_desc_to_code[desc_lower]
-                
-                # Extract height for per-meter calculation
-                height = extract_tower_height(erp_description)
-                
-                if matched_code in rate_card_lookup:
-                    result['matched_code'] = matched_code
-                    result['matched_name'] = rate_card_lookup[matched_code]['name']
-                    result['rate_card_idx'] = rate_card_lookup[matched_code]['idx']
-                    
-                    if height and height > 0 and erp_price:
-                        result['final_price'] = round(erp_price / height, 2)
-                        result['note'] = f"£{erp_price:.2f} ÷ {height}m = £{result['final_price']:.2f}/m"
-                    else:
-                        result['final_price'] = erp_price
-                        if not height:
-                            result['note'] = "Could not extract height for per-meter calc"
-                    
-                    result['status'] = 'matched'
-                else:
-                    result['note'] = f"Converted code {matched_code} not in rate card"
-            else:
-                result['note'] = f"Tower description not found in conversion table"
-        
-        else:
-            result['note'] = f"Unknown product type for code: {erp_code}"
-        
-        results.append(result)
+        for code, description, price_value, matched, name, label, final, kind, status, text, match, suggestion in columns
+    ]
+
+# ERP export files are read in chunks so large exports never sit in memory (or session state) whole
+ERP_IMPORT_CHUNK_ROWS = 5000
+ERP_FILE_TYPES = ["tsv", "txt", "csv", "xlsx"]
+
+def _erp_rows_frame(rows):
+    """Frame of text columns from row lists, dropping blank and short rows"""
+    rows = [row for row in rows if len(row) >= ERP_MIN_COLUMNS and any(cell.strip() for cell in row)]
+    if not rows:
+        return pd.DataFrame(columns=range(ERP_MIN_COLUMNS), dtype=object)
+    return pd.DataFrame(rows, dtype=object)
+
+def _detect_erp_encoding(file):
+    """UTF-8 unless the start of the file says otherwise (Windows exports write £ as cp1252)"""
+    head = file.read(65536)
+    file.seek(0)
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:  # Not just a character cut at the sample boundary
+            return "cp1252"
+    return "utf-8-sig"
+
+def iter_erp_file_chunks(file, chunk_rows=ERP_IMPORT_CHUNK_ROWS):
+    """Yield (column frame, fraction read) for each chunk of an ERP export file (TSV/CSV/XLSX)"""
+    name = getattr(file, "name", "").lower()
+    file.seek(0, io.SEEK_END)
+    total_bytes = file.tell() or 1
+    file.seek(0)
+    
+    if name.endswith(".xlsx"):
+        from openpyxl import load_workbook
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            total_rows = sheet.max_row or 1
+            rows = sheet.iter_rows(values_only=True)
+            done = 0
+            while chunk := list(islice(rows, chunk_rows)):
+                done += len(chunk)
+                cells = [["" if value is None else str(value) for value in row] for row in chunk]
+                yield _erp_rows_frame(cells), min(done / total_rows, 1.0)
+        finally:
+            workbook.close()
+        return
     
+    text = io.TextIOWrapper(file, encoding=_detect_erp_encoding(file), errors="replace", newline="")
+    try:
+        if name.endswith(".csv"):
+            rows = csv.reader(text)
+            while chunk := list(islice(rows, chunk_rows)):
+                yield _erp_rows_frame(chunk), min(file.tell() / total_bytes, 1.0)
+        else:
+            # Tab-delimited exactly like a paste (no quoting rules)
+            while chunk := list(islice(text, chunk_rows)):
+                yield split_erp_lines(chunk), min(file.tell() / total_bytes, 1.0)
+    finally:
+        text.detach()  # Leave the upload open for the caller
+
+def parse_erp_file(file, matcher, progress_callback=None):
+    """Parse and match an ERP export file chunk by chunk, reporting the fraction done after each chunk"""
+    results = []
+    for rows, fraction in iter_erp_file_chunks(file):
+        results.extend(match_erp_rows(rows, matcher))
+        if progress_callback is not None:
+            progress_callback(fraction)
     return results
 
+# -------------------------------
+# Syrinx Import Functions
+# -------------------------------
+def read_syrinx_file(file):
+    """Read a Syrinx export: Category Codes in column A, special prices in column B, no header"""
+    return pd.read_excel(file, header=None, usecols=[0, 1], names=['CategoryCode', 'SpecialPrice'], dtype=object)
+
+def match_syrinx_prices(syrinx_df, rate_card_df, rate_card_index):
+    """
+    Match Syrinx rows to the rate card in one hash join on the code index.
+    
+    Returns a dict with:
+    - matched: DataFrame of code, equipment, special_price, list_price and rate card position
+    - ignored: codes that are not on the rate card or have no valid price
+    - total_processed: number of Syrinx rows
+    """
+    codes = syrinx_df['CategoryCode'].astype(str).str.strip()
+    prices = pd.to_numeric(syrinx_df['SpecialPrice'], errors='coerce')
+    positions = codes.map(rate_card_index["positions_by_code"])
+    is_matched = (positions.notna() & prices.notna()).to_numpy()
+    matched_positions = positions[is_matched].astype(int).to_numpy()
+    
+    return {
+        'matched': pd.DataFrame({
+            'code': codes[is_matched].to_numpy(),
+            'equipment': rate_card_index["names"][matched_positions],
+            'special_price': prices[is_matched].to_numpy("float64"),
+            'list_price': pd.to_numeric(rate_card_df["HireRateWeekly"], errors='coerce').to_numpy()[matched_positions],
+            'position': matched_positions,
+        }),
+        'ignored': codes[~is_matched].tolist(),
+        'total_processed': len(syrinx_df)
+    }
+
+def process_syrinx_file(syrinx_file):
+    """Read and match a Syrinx Excel file against this session's rate card - None on error"""
+    try:
+        rate_card = get_session_rate_card()
+        return match_syrinx_prices(read_syrinx_file(syrinx_file), rate_card["data"], rate_card["index"])
+    except Exception as e:
+        st.error(f"Error processing Syrinx file: {str(e)}")
+        return None
+
 # -------------------------------
 # Session State Initialization
 # -------------------------------
@@ -311,8 +596,10 @@ def initialize_session_state():
     if 'pending_prices' not in st.session_state:
         st.session_state.pending_prices = {}
     
-    if 'df' not in st.session_state:
-        st.session_state['df'] = None
+    if 'pricing_state' not in st.session_state:
+        st.session_state['pricing_state'] = None
+    
+    start_source_watcher()
 
 # -------------------------------
 # Price/POA Helper Functions
@@ -328,9 +615,11 @@ def get_numeric_price(value):
     if is_poa_value(value):
         return None
     try:
-        return float(value)
+        numeric_value = float(value)
     except (ValueError, TypeError):
         return None
+    # Typed price columns store POA as NaN
+    return None if np.isnan(numeric_value) else numeric_value
 
 def format_price_display(value):
     """Format price for display - handles both numeric and POA values"""
@@ -374,6 +663,14 @@ def format_discount_for_export(value):
     except (ValueError, TypeError):
         return "POA"
 
+def format_price_array(prices, prefix="£", suffix="", decimals=2):
+    """Format a whole float price/percent column at once - NaN (POA) becomes "POA" """
+    values = np.asarray(prices, dtype="float64")
+    poa_mask = np.isnan(values)
+    template = prefix.replace("%", "%%") + f"%.{decimals}f" + suffix.replace("%", "%%")
+    text = np.char.mod(template, np.where(poa_mask, 0.0, values))
+    return np.where(poa_mask, "POA", text).astype(object)
+
 def format_custom_price_for_display(value):
     """Format custom price for display - includes £ symbol"""
     if pd.isna(value) or is_poa_value(value) or value == "POA" or value is None:
@@ -391,8 +688,7 @@ def format_custom_price_for_display(value):
 # -------------------------------
 def get_discounted_price(row, global_discount):
     """Calculate discounted price, handling POA values"""
-    key = f"{row['GroupName']}_{row['Sub Section']}_discount"
-    discount = st.session_state.get(key, global_discount)
+    discount = get_group_discount(row['GroupName'], row['Sub Section'], global_discount)
     
     if is_poa_value(row["HireRateWeekly"]):
         return "POA"
@@ -419,6 +715,146 @@ def calculate_discount_percent(original, custom):
     
     return ((orig_numeric - custom_numeric) / orig_numeric) * 100
 
+def calculate_net_prices(list_prices, list_poa, group_discounts, override_prices, override_set, override_poa):
+    """Price every rate card row in one NumPy pass.
+    
+    Args:
+        list_prices: float64 list prices (NaN where POA)
+        list_poa: bool mask of POA list prices
+        group_discounts: float64 discount % applying to each row
+        override_prices: float64 special rates (ignored where not set)
+        override_set: bool mask of rows with a special rate entered
+        override_poa: bool mask of special rates that are POA (or not a number)
+    
+    Returns:
+        (net_prices, discount_percents): float64 arrays, NaN meaning POA
+    """
+    list_prices = np.asarray(list_prices, dtype="float64")
+    list_poa = np.asarray(list_poa, dtype=bool) | np.isnan(list_prices)
+    group_discounts = np.asarray(group_discounts, dtype="float64")
+    override_prices = np.asarray(override_prices, dtype="float64")
+    override_set = np.asarray(override_set, dtype=bool)
+    override_poa = override_set & (np.asarray(override_poa, dtype=bool) | np.isnan(override_prices))
+    
+    with np.errstate(invalid="ignore", divide="ignore"):
+        calculated = np.where(list_poa, np.nan, list_prices * (1 - group_discounts / 100))
+        override_discount = np.where(
+            list_prices == 0, 0.0, (list_prices - override_prices) / list_prices * 100
+        )
+    
+    net_prices = np.where(override_set, override_prices, calculated)
+    discount_percents = np.where(
+        override_set,
+        np.where(list_poa, np.nan, override_discount),
+        np.where(list_poa, np.nan, group_discounts)
+    )
+    net_prices[override_poa] = np.nan
+    discount_percents[override_poa] = np.nan
+    return net_prices, discount_percents
+
+# -------------------------------
+# Workbook Snapshot Cache
+# -------------------------------
+# Parsing the full workbook with openpyxl takes seconds, but the app only needs
+# a handful of columns from one sheet. The first load compiles those columns
+# into a pickled snapshot next to the workbook; every later process reuses it
+# until the workbook's mtime/size (or, failing that, its content hash) changes.
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_READ_ATTEMPTS = 3  # Re-reads if the workbook is replaced while it is being read
+RATE_CARD_COLUMNS = [
+    "ItemCategory", "EquipmentName", "HireRateWeekly", "GroupName", "Sub Section",
+    "Max Discount", "Include", "Order", "ExcludeFromGlobalDiscount"
+]
+
+def get_snapshot_path(source_path):
+    """Get the snapshot file path for a workbook (stored alongside it)"""
+    base, _ = os.path.splitext(source_path)
+    return f"{base}.snapshot.pkl"
+
+def get_file_signature(file_path):
+    """Get a cheap change signature for a file: (mtime in ns, size in bytes)"""
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def get_file_hash(file_path):
+    """Get the SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_workbook_snapshot(source_path, snapshot):
+    """Atomically write a snapshot file - silently skipped on read-only filesystems"""
+    snapshot_path = get_snapshot_path(source_path)
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+        return True
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+def read_file_consistently(file_path):
+    """Read a file's bytes with the signature they belong to - (content, (mtime in ns, size))"""
+    for _ in range(SNAPSHOT_READ_ATTEMPTS):
+        signature = get_file_signature(file_path)
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        if get_file_signature(file_path) == signature:
+            return content, signature
+    raise OSError(f"{os.path.basename(file_path)} kept changing while it was being read")
+
+def compile_workbook_snapshot(source_path, sheet_name=0, columns=None):
+    """Parse one sheet (optionally only some columns) and store it as a snapshot"""
+    # Parse and hash the same bytes the signature was taken for, so a workbook
+    # replaced mid-read can't leave old content cached under the new signature
+    content, (mtime_ns, size) = read_file_consistently(source_path)
+    usecols = (lambda column: column in columns) if columns else None
+    frame = pd.read_excel(io.BytesIO(content), sheet_name=sheet_name, usecols=usecols, engine='openpyxl')
+    snapshot = {
+        "format": SNAPSHOT_FORMAT_VERSION,
+        "sheet_name": sheet_name,
+        "columns": list(columns) if columns else None,
+        "mtime_ns": mtime_ns,
+        "size": size,
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "frame": frame,
+    }
+    write_workbook_snapshot(source_path, snapshot)
+    return snapshot
+
+def read_workbook_snapshot(source_path, sheet_name=0, columns=None):
+    """Load a sheet from its snapshot, recompiling only if the workbook changed"""
+    try:
+        with open(get_snapshot_path(source_path), 'rb') as f:
+            snapshot = pickle.load(f)
+    except Exception:
+        # Missing, truncated or written by an incompatible pandas - rebuild it
+        snapshot = None
+    
+    if (
+        isinstance(snapshot, dict)
+        and snapshot.get("format") == SNAPSHOT_FORMAT_VERSION
+        and snapshot.get("sheet_name") == sheet_name
+        and snapshot.get("columns") == (list(columns) if columns else None)
+    ):
+        mtime_ns, size = get_file_signature(source_path)
+        if snapshot["mtime_ns"] == mtime_ns and snapshot["size"] == size:
+            return snapshot["frame"]
+        # Deploys and checkouts touch the mtime without changing the content
+        if snapshot["size"] == size and snapshot["sha256"] == get_file_hash(source_path):
+            snapshot["mtime_ns"] = mtime_ns
+            write_workbook_snapshot(source_path, snapshot)
+            return snapshot["frame"]
+    
+    return compile_workbook_snapshot(source_path, sheet_name=sheet_name, columns=columns)["frame"]
+
 # -------------------------------
 # Data Loading Functions
 # -------------------------------
@@ -427,11 +863,6 @@ def load_excel(file):
     """Load Excel file with caching"""
     return pd.read_excel(file, engine='openpyxl')
 
-@st.cache_data
-def load_excel_with_timestamp(file_path, timestamp):
-    """Load Excel file with timestamp-based cache invalidation"""
-    return pd.read_excel(file_path, engine='openpyxl')
-
 def get_available_pdf_files():
     """Get list of available PDF files in the script directory"""
     import glob
@@ -443,50 +874,827 @@ def get_available_pdf_files():
         st.error(f"Error scanning for PDF files: {e}")
         return []
 
-def load_dataframe():
-    """Load and validate the main DataFrame"""
-    df = None
+RATE_CARD_CATEGORY_COLUMNS = ["GroupName", "Sub Section", "ItemCategory"]
+
+def build_rate_card(raw_df):
+    """Validate, filter and sort the raw rate card columns - raises ValueError if invalid"""
+    required_columns = {"ItemCategory", "EquipmentName", "HireRateWeekly", "GroupName", "Sub Section", "Max Discount", "Include", "Order"}
+    if not required_columns.issubset(raw_df.columns):
+        raise ValueError(f"Excel file must contain: {', '.join(required_columns)}")
     
-    if os.path.exists(DEFAULT_EXCEL_PATH):
-        try:
-            mod_time = os.path.getmtime(DEFAULT_EXCEL_PATH)
-            df = load_excel_with_timestamp(DEFAULT_EXCEL_PATH, mod_time)
-            
-            required_columns = {"ItemCategory", "EquipmentName", "HireRateWeekly", "GroupName", "Sub Section", "Max Discount", "Include", "Order"}
-            if not required_columns.issubset(df.columns):
-                st.error(f"Excel file must contain: {', '.join(required_columns)}")
-                return None
-            
-            if "ExcludeFromGlobalDiscount" not in df.columns:
-                df["ExcludeFromGlobalDiscount"] = False
-            
-            df = df[df["Include"] == True].copy()
-            df.sort_values(by=["GroupName", "Sub Section", "Order"], inplace=True)
-            
-            if 'CustomPrice' not in df.columns:
-                df['CustomPrice'] = None
-            if 'DiscountPercent' not in df.columns:
-                df['DiscountPercent'] = None
-            
-            return df
-            
-        except Exception as e:
+    df = raw_df.copy()
+    if "ExcludeFromGlobalDiscount" not in df.columns:
+        df["ExcludeFromGlobalDiscount"] = False
+    
+    df = df[df["Include"] == True].copy()
+    df.sort_values(by=["GroupName", "Sub Section", "Order"], inplace=True)
+    
+    # Normalize once so downstream code can work on arrays: float64 prices
+    # (POA/blank -> NaN) with a POA mask, and categorical grouping columns
+    df["HireRateWeekly"] = pd.to_numeric(df["HireRateWeekly"], errors="coerce").astype("float64")
+    df["IsPOA"] = df["HireRateWeekly"].isna()
+    df["ExcludeFromGlobalDiscount"] = df["ExcludeFromGlobalDiscount"].fillna(False).astype(bool)
+    for column in RATE_CARD_CATEGORY_COLUMNS:
+        df[column] = df[column].astype(str).astype("category")
+    return df
+
+def load_dataframe(report_errors=True):
+    """Load and validate the shared base DataFrame this session is using"""
+    try:
+        return get_session_rate_card()["data"]
+    except FileNotFoundError:
+        if report_errors:
+            st.error(f"No Excel file found at: {DEFAULT_EXCEL_PATH}")
+        return None
+    except ValueError as e:
+        if report_errors:
+            st.error(str(e))
+        return None
+    except Exception as e:
+        if report_errors:
             st.error(f"Failed to load Excel: {e}")
-            return None
-    else:
-        st.error(f"No Excel file found at: {DEFAULT_EXCEL_PATH}")
         return None
 
 def ensure_dataframe_loaded():
-    """Ensure DataFrame is loaded into session state"""
-    if st.session_state.get('df') is None or (hasattr(st.session_state.get('df'), 'empty') and st.session_state['df'].empty):
-        df = load_dataframe()
-        if df is not None:
-            st.session_state['df'] = df
-            return True
+    """Ensure the shared base DataFrame is available"""
+    return load_dataframe() is not None
+
+# -------------------------------
+# Source Watcher (Hot-Swap)
+# -------------------------------
+# The rate card and conversion table are held as versioned, process-wide
+# entries. A background thread polls the source files and compiles any new
+# version off the request path, then swaps it in with a single assignment.
+# Sessions stay pinned to the rate card version they started with until the
+# user chooses to switch, so a swap never changes prices mid-quote.
+WATCH_INTERVAL_SECONDS = 10
+SOURCE_VERSIONS_KEPT = 2
+
+def _load_rate_card_source(file_path):
+    return build_rate_card(read_workbook_snapshot(file_path, columns=RATE_CARD_COLUMNS))
+
+def _load_conversion_table_source(file_path):
+    return read_workbook_snapshot(file_path)
+
+WATCHED_SOURCES = {
+    "rate_card": (DEFAULT_EXCEL_PATH, _load_rate_card_source),
+    "conversion_table": (CONVERSION_TABLE_FILE, _load_conversion_table_source),
+}
+
+_source_lock = threading.Lock()
+_current_sources = {}        # name -> entry currently served to new sessions
+_source_versions = {}        # name -> {version: entry}, current plus recently replaced
+_source_failures = {}        # name -> (signature, error message) of the last failed compile
+
+def get_source_version(signature):
+    """Build a short version label from a file signature"""
+    mtime_ns, size = signature
+    return f"{mtime_ns // 1_000_000:x}-{size:x}"
+
+def refresh_source(name):
+    """Compile a watched source if its file changed, then atomically swap it in"""
+    file_path, loader = WATCHED_SOURCES[name]
+    signature = get_file_signature(file_path)
+    current = _current_sources.get(name)
+    if current is not None and current["signature"] == signature:
+        return current
+    
+    with _source_lock:
+        current = _current_sources.get(name)
+        if current is not None and current["signature"] == signature:
+            return current
+        
+        try:
+            data = loader(file_path)
+        except Exception as e:
+            _source_failures[name] = (signature, str(e))
+            raise
+        
+        entry = {
+            "name": name,
+            "version": get_source_version(signature),
+            "signature": signature,
+            "data": data,
+            "loaded_at": get_uk_time(),
+        }
+        if name == "rate_card":
+            entry["index"] = build_rate_card_index(data)
+            entry["search"] = build_search_index(data)
+            entry["trigrams"] = build_trigram_index(data["EquipmentName"].astype(str) + " " + data["ItemCategory"].astype(str))
+        elif name == "conversion_table":
+            entry["trigrams"] = build_trigram_index(data["EQP_NAME"].astype(str))
+            entry["product_types"] = data["Type"].astype(str).str.strip().to_numpy()
+        
+        versions = _source_versions.setdefault(name, {})
+        versions[entry["version"]] = entry
+        while len(versions) > SOURCE_VERSIONS_KEPT:
+            versions.pop(next(iter(versions)))
+        
+        _source_failures.pop(name, None)
+        _current_sources[name] = entry
+        return entry
+
+def get_current_source(name):
+    """Get the newest compiled entry for a source (loads it on first use)"""
+    entry = _current_sources.get(name)
+    if entry is None:
+        entry = refresh_source(name)
+    return entry
+
+def get_source_entry(name, version):
+    """Get a specific retained version of a source, or None if it was dropped"""
+    return _source_versions.get(name, {}).get(version)
+
+def _watch_sources(interval):
+    """Watcher thread body - poll source files and compile new versions"""
+    while True:
+        time.sleep(interval)
+        for name, (file_path, _) in WATCHED_SOURCES.items():
+            try:
+                failure = _source_failures.get(name)
+                if failure and failure[0] == get_file_signature(file_path):
+                    continue  # Same broken file as last time - wait for it to change
+                refresh_source(name)
+            except Exception:
+                # Keep serving the last good version; the next poll retries
+                pass
+
+@st.cache_resource(show_spinner=False)
+def start_source_watcher(interval=WATCH_INTERVAL_SECONDS):
+    """Start the background source watcher (once per process)"""
+    thread = threading.Thread(
+        target=_watch_sources, args=(interval,), name="rate-card-watcher", daemon=True
+    )
+    thread.start()
+    return thread
+
+def get_session_rate_card():
+    """Get the rate card entry this session is pinned to"""
+    current = get_current_source("rate_card")
+    pinned = st.session_state.get('rate_card_version')
+    if pinned is not None and pinned != current["version"]:
+        entry = get_source_entry("rate_card", pinned)
+        if entry is not None:
+            return entry
+        # Pinned version is no longer retained - move the session forward
+        switch_to_current_rate_card()
+        return current
+    st.session_state['rate_card_version'] = current["version"]
+    return current
+
+def is_new_rate_card_available():
+    """Check whether a newer rate card than this session's has been loaded"""
+    current = _current_sources.get("rate_card")
+    pinned = st.session_state.get('rate_card_version')
+    return current is not None and pinned is not None and pinned != current["version"]
+
+def switch_to_current_rate_card():
+    """Move this session onto the newest rate card, carrying custom prices by ItemCategory"""
+    current = get_current_source("rate_card")
+    pinned = st.session_state.get('rate_card_version')
+    if pinned == current["version"]:
         return False
+    
+    store = st.session_state.get('custom_price_store')
+    if store is not None:
+        st.session_state['custom_price_store'] = store.remap(current)
+    
+    st.session_state['rate_card_version'] = current["version"]
+    st.session_state['pricing_state'] = None
     return True
 
+# -------------------------------
+# Priced Rate Card (Materialize Stage)
+# -------------------------------
+# Every page, export and the dashboard read one priced table per session: the
+# shared base rate card plus this session's CustomPrice/DiscountPercent
+# columns (float64, NaN = POA). It is rebuilt only when the pricing state
+# revision changes, so all outputs show identical numbers.
+def compose_rate_card(base_df, net_prices=None, discount_percents=None):
+    """Compose the base rate card with net price columns (the base is never modified)"""
+    view = base_df.copy(deep=False)
+    if net_prices is not None:
+        view["CustomPrice"] = np.array(net_prices, dtype="float64")
+        view["DiscountPercent"] = np.array(discount_percents, dtype="float64")
+    else:
+        view["CustomPrice"] = np.nan
+        view["DiscountPercent"] = np.nan
+    return view
+
+def get_session_dataframe(report_errors=True):
+    """Get this session's priced rate card, materializing any pricing changes first"""
+    base_df = load_dataframe(report_errors=report_errors)
+    if base_df is None:
+        return None
+    materialize_net_prices(st.session_state.get('global_discount', 0.0))
+    state = st.session_state['pricing_state']
+    if state["table"] is None:
+        state["table"] = compose_rate_card(base_df, state["net_prices"], state["discount_percents"])
+    return state["table"]
+
+# -------------------------------
+# Custom Price Store
+# -------------------------------
+# Special rates used to be one price_{idx} string key per row in session
+# state. They now live in one compact store per session: a float array plus
+# set/POA masks by row position, addressable by ItemCategory.
+def parse_custom_price(value):
+    """Parse a special rate entry into (price, is_poa) - blank gives (None, False)"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None, False
+    text = str(value).strip()
+    if not text:
+        return None, False
+    if is_poa_value(text):
+        return None, True
+    try:
+        price = float(text)
+    except ValueError:
+        # Anything that isn't a number is priced as POA
+        return None, True
+    if np.isnan(price):
+        return None, True
+    return price, False
+
+def is_valid_custom_price(value):
+    """Check a special rate entry is blank, POA or a number"""
+    text = "" if value is None else str(value).strip()
+    if not text or is_poa_value(text):
+        return True
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def format_custom_price_text(price):
+    """Format a stored special rate for editing/saving without losing precision"""
+    if round(price, 2) == price:
+        return f"{price:.2f}"
+    return repr(float(price))  # Plain digits - NumPy 2 scalars repr as "np.float64(...)"
+
+class CustomPriceStore:
+    """Special rates for one rate card version, held as arrays by row position.
+    
+    Counting is O(1), iteration only visits rows that have a special rate,
+    and every change is recorded so pricing can re-price just those rows.
+    """
+    
+    def __init__(self, entry):
+        size = len(entry["index"]["codes"])
+        self.version = entry["version"]
+        self.codes = entry["index"]["codes"]  # Shared with the rate card entry, never copied
+        self.positions_by_code = entry["index"]["positions_by_code"]
+        self.prices = np.full(size, np.nan)
+        self.is_set = np.zeros(size, dtype=bool)
+        self.is_poa = np.zeros(size, dtype=bool)
+        self._set_positions = set()
+        self._dirty = set()
+        self.revision = 0  # Bumped on every change, for memoizing derived tables
+    
+    def __len__(self):
+        return len(self._set_positions)
+    
+    def get_text(self, position):
+        """Get the special rate of a row as text ("" if none)"""
+        if not self.is_set[position]:
+            return ""
+        if self.is_poa[position]:
+            return "POA"
+        return format_custom_price_text(self.prices[position])
+    
+    def set(self, position, value):
+        """Set a row's special rate from user input ("" clears it) - returns True if changed"""
+        price, is_poa = parse_custom_price(value)
+        if price is None and not is_poa:
+            return self.clear(position)
+        if self.is_set[position] and self.is_poa[position] == is_poa and (is_poa or self.prices[position] == price):
+            return False
+        self.prices[position] = np.nan if is_poa else price
+        self.is_set[position] = True
+        self.is_poa[position] = is_poa
+        self._set_positions.add(position)
+        self._dirty.add(position)
+        self.revision += 1
+        return True
+    
+    def set_by_code(self, code, value):
+        """Set a special rate by ItemCategory - returns False if the code is not on the card"""
+        position = self.positions_by_code.get(str(code).strip())
+        if position is None:
+            return False
+        self.set(position, value)
+        return True
+    
+    def clear(self, position):
+        """Remove a row's special rate - returns True if it had one"""
+        if not self.is_set[position]:
+            return False
+        self.prices[position] = np.nan
+        self.is_set[position] = False
+        self.is_poa[position] = False
+        self._set_positions.discard(position)
+        self._dirty.add(position)
+        self.revision += 1
+        return True
+    
+    def clear_all(self):
+        """Remove every special rate - returns how many were cleared"""
+        positions = list(self._set_positions)
+        self.prices[positions] = np.nan
+        self.is_set[positions] = False
+        self.is_poa[positions] = False
+        self._set_positions.clear()
+        self._dirty.update(positions)
+        if positions:
+            self.revision += 1
+        return len(positions)
+    
+    def positions(self):
+        """Row positions that have a special rate, in rate card order"""
+        return sorted(self._set_positions)
+    
+    def items(self):
+        """Iterate (position, ItemCategory, text) for rows with a special rate"""
+        for position in self.positions():
+            yield position, self.codes[position], self.get_text(position)
+    
+    def vectors(self, positions=None):
+        """Get (prices, set mask, POA mask) arrays, optionally for some rows only"""
+        if positions is None:
+            return self.prices, self.is_set, self.is_poa
+        return self.prices[positions], self.is_set[positions], self.is_poa[positions]
+    
+    def snapshot(self):
+        """Copy the store's arrays (prices, set mask, POA mask)"""
+        return self.prices.copy(), self.is_set.copy(), self.is_poa.copy()
+    
+    def restore(self, positions, prices, is_set, is_poa):
+        """Put rows back to recorded values (used by undo/redo)"""
+        self.prices[positions] = prices
+        self.is_set[positions] = is_set
+        self.is_poa[positions] = is_poa
+        for position, has_price in zip(positions.tolist(), is_set.tolist()):
+            if has_price:
+                self._set_positions.add(position)
+            else:
+                self._set_positions.discard(position)
+        self._dirty.update(positions.tolist())
+        self.revision += 1
+    
+    def set_many(self, positions, values):
+        """Set many rows' special rates from saved entries in one overlay (blank entries are skipped) - returns the count set"""
+        parsed = [parse_custom_price(value) for value in values]  # Python floats: exact round trip of saved text
+        keep = np.array([price is not None or is_poa for price, is_poa in parsed], dtype=bool)
+        positions = np.asarray(positions, dtype=int)[keep]
+        prices = np.array([np.nan if price is None else price for price, _ in parsed], dtype="float64")[keep]
+        is_poa = np.array([is_poa for _, is_poa in parsed], dtype=bool)[keep]
+        self.restore(positions, prices, np.ones(len(positions), dtype=bool), is_poa)
+        return len(positions)
+    
+    def pop_dirty(self):
+        """Get and reset the row positions changed since the last call"""
+        positions = np.fromiter(self._dirty, dtype=int, count=len(self._dirty))
+        self._dirty.clear()
+        return positions
+    
+    def remap(self, entry):
+        """Build a store for another rate card version, matching rows by ItemCategory"""
+        store = CustomPriceStore(entry)
+        for _, code, text in self.items():
+            store.set_by_code(code, text)
+        return store
+
+def get_custom_price_store():
+    """Get this session's special rates store for its rate card version"""
+    entry = get_session_rate_card()
+    store = st.session_state.get('custom_price_store')
+    if store is None or store.version != entry["version"]:
+        store = store.remap(entry) if store is not None else CustomPriceStore(entry)
+        st.session_state['custom_price_store'] = store
+    return store
+
+# -------------------------------
+# Incremental Pricing State
+# -------------------------------
+# The rate card is sorted by GroupName/Sub Section/Order, so every group is a
+# contiguous row range. Each session keeps its last materialized net prices
+# plus the group discounts they were priced with; a rerun only re-prices the
+# ranges of groups whose discount changed and the rows whose special rate was
+# edited since (recorded by the custom price store). Group discounts are one
+# float per group id, so a row's discount is a gather through row_group.
+def build_rate_card_index(df):
+    """Build the lookup bundle of a sorted rate card (built once per rate card version).
+    
+    Holds the ItemCategory -> row position map, the group registry (integer
+    group ids in rate card order, (group, subsection) -> row slice, row ->
+    group id) and the groups excluded from the global discount.
+    
+    A few codes appear on more than one row, so positions_by_code keeps the
+    last one; rows are told apart by their item key (code, nth occurrence).
+    """
+    codes = df["ItemCategory"].astype(str).to_numpy()
+    stripped_codes = pd.Series(codes, dtype=object).str.strip()
+    item_keys = list(zip(stripped_codes, stripped_codes.groupby(stripped_codes, sort=False).cumcount().tolist()))
+    group_keys = pd.MultiIndex.from_arrays([df["GroupName"], df["Sub Section"]])
+    row_group, unique_keys = pd.factorize(group_keys)
+    starts = np.flatnonzero(np.r_[True, row_group[1:] != row_group[:-1]]) if len(row_group) else np.array([], dtype=int)
+    ends = np.r_[starts[1:], len(row_group)].astype(int)
+    excluded = df["ExcludeFromGlobalDiscount"].to_numpy(bool)
+    excluded = np.logical_or.reduceat(excluded, starts) if len(starts) else np.zeros(0, dtype=bool)
+    keys = list(unique_keys)
+    discount_keys = [f"{group}_{subsection}_discount" for group, subsection in keys]
+    
+    subsections_by_group = {}
+    for group, subsection in keys:
+        subsections_by_group.setdefault(group, []).append(subsection)
+    
+    return {
+        "codes": codes,
+        "names": df["EquipmentName"].to_numpy(),
+        "positions_by_code": {code.strip(): position for position, code in enumerate(codes)},
+        "item_keys": item_keys,
+        "positions_by_item_key": {key: position for position, key in enumerate(item_keys)},
+        "keys": keys,
+        "ids_by_key": {key: group_id for group_id, key in enumerate(keys)},
+        "discount_keys": discount_keys,
+        "ids_by_discount_key": {key: group_id for group_id, key in enumerate(discount_keys)},
+        "subsections_by_group": subsections_by_group,
+        "ranges": {key: slice(int(start), int(end)) for key, start, end in zip(keys, starts, ends)},
+        "excluded": excluded,
+        "excluded_keys": {key for key, is_excluded in zip(keys, excluded) if is_excluded},
+        "row_group": row_group,
+        "starts": starts,
+        "ends": ends,
+    }
+
+class GroupDiscountVector:
+    """Group discounts for one rate card version, one float per group id.
+    
+    NaN means the group has not been set and follows the global discount.
+    Bulk actions (apply to all, reset) are single array operations.
+    """
+    
+    def __init__(self, entry):
+        self.version = entry["version"]
+        self.layout = entry["index"]
+        self.values = np.full(len(self.layout["keys"]), np.nan)
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def effective(self, global_discount):
+        """Get the discount % applying to every group"""
+        return np.where(np.isnan(self.values), global_discount, self.values)
+    
+    def get(self, group_id, global_discount):
+        """Get the discount % applying to one group"""
+        value = self.values[group_id]
+        return global_discount if np.isnan(value) else float(value)
+    
+    def set(self, group_id, value):
+        """Set one group's discount %"""
+        self.values[group_id] = float(value)
+    
+    def set_by_key(self, discount_key, value):
+        """Set a group discount by its saved "{group}_{subsection}_discount" key - returns False if unknown"""
+        group_id = self.layout["ids_by_discount_key"].get(discount_key)
+        if group_id is None:
+            return False
+        self.set(group_id, value)
+        return True
+    
+    def set_many_by_key(self, discounts):
+        """Set group discounts from a {"{group}_{subsection}_discount": value} mapping in one overlay - returns the count set"""
+        ids_by_key = self.layout["ids_by_discount_key"]
+        known = [(ids_by_key[key], value) for key, value in discounts.items() if key in ids_by_key]
+        if known:
+            group_ids, values = zip(*known)
+            self.values[list(group_ids)] = np.array(values, dtype="float64")
+        return len(known)
+    
+    def initialize(self, global_discount):
+        """Give unset groups a starting value: the global discount, or 0 if excluded"""
+        unset = np.isnan(self.values)
+        self.values[unset] = np.where(self.layout["excluded"], 0.0, global_discount)[unset]
+    
+    def apply_to_all(self, global_discount):
+        """Set every group to the global discount (excluded groups to 0) - returns (applied, skipped)"""
+        excluded = self.layout["excluded"]
+        self.values = np.where(excluded, 0.0, float(global_discount))
+        skipped = int(excluded.sum())
+        return len(self.values) - skipped, skipped
+    
+    def reset(self):
+        """Set every group discount to 0"""
+        self.values = np.zeros(len(self.values))
+    
+    def items(self):
+        """Iterate ("{group}_{subsection}_discount", value) for groups that have been set"""
+        discount_keys = self.layout["discount_keys"]
+        for group_id in np.flatnonzero(~np.isnan(self.values)):
+            yield discount_keys[group_id], float(self.values[group_id])
+    
+    def remap(self, entry):
+        """Build a vector for another rate card version, matching groups by (group, subsection)"""
+        vector = GroupDiscountVector(entry)
+        for discount_key, value in self.items():
+            vector.set_by_key(discount_key, value)
+        return vector
+
+def get_group_discount_vector():
+    """Get this session's group discount vector for its rate card version"""
+    entry = get_session_rate_card()
+    vector = st.session_state.get('group_discount_vector')
+    if vector is None or vector.version != entry["version"]:
+        vector = vector.remap(entry) if vector is not None else GroupDiscountVector(entry)
+        st.session_state['group_discount_vector'] = vector
+    return vector
+
+def get_group_discount(group, subsection, global_discount):
+    """Get the discount % applying to one (group, subsection)"""
+    entry = get_session_rate_card()
+    group_id = entry["index"]["ids_by_key"].get((group, subsection))
+    if group_id is None:
+        return global_discount
+    return get_group_discount_vector().get(group_id, global_discount)
+
+def price_rate_card_rows(entry, group_discounts, store, positions=None):
+    """Price all rows of a rate card entry, or only the given row positions"""
+    df = entry["data"]
+    row_group = entry["index"]["row_group"]
+    if positions is not None:
+        df = df.iloc[positions]
+        row_group = row_group[positions]
+    override_prices, override_set, override_poa = store.vectors(positions)
+    return calculate_net_prices(
+        df["HireRateWeekly"].to_numpy("float64"),
+        df["IsPOA"].to_numpy(bool),
+        group_discounts[row_group],
+        override_prices,
+        override_set,
+        override_poa
+    )
+
+def get_pricing_fingerprint(global_discount):
+    """Identify this session's pricing inputs (rate card version, group discounts, special rates)"""
+    entry = get_session_rate_card()
+    store = get_custom_price_store()
+    group_discounts = get_group_discount_vector().effective(global_discount)
+    return (entry["version"], group_discounts.tobytes(), id(store), store.revision)
+
+def materialize_net_prices(global_discount):
+    """Bring this session's net prices up to date, re-pricing only what changed.
+    
+    Returns:
+        (net_prices, discount_percents): float64 arrays aligned to the rate card
+    """
+    entry = get_session_rate_card()
+    store = get_custom_price_store()
+    layout = entry["index"]
+    group_discounts = get_group_discount_vector().effective(global_discount)
+    state = st.session_state.get('pricing_state')
+    dirty_positions = store.pop_dirty()
+    
+    if state is None or state["version"] != entry["version"]:
+        net_prices, discount_percents = price_rate_card_rows(entry, group_discounts, store)
+        state = {
+            "version": entry["version"],
+            "group_discounts": group_discounts,
+            "net_prices": net_prices,
+            "discount_percents": discount_percents,
+            "revision": 0,
+            "table": None,  # Priced rate card, built on demand by get_session_dataframe
+        }
+        st.session_state['pricing_state'] = state
+        return net_prices, discount_percents
+    
+    changed_groups = np.flatnonzero(group_discounts != state["group_discounts"])
+    if len(changed_groups) == 0 and len(dirty_positions) == 0:
+        return state["net_prices"], state["discount_percents"]
+    
+    positions = np.unique(np.concatenate(
+        [np.arange(layout["starts"][g], layout["ends"][g]) for g in changed_groups] + [dirty_positions]
+    ).astype(int))
+    net_prices, discount_percents = price_rate_card_rows(entry, group_discounts, store, positions)
+    state["net_prices"][positions] = net_prices
+    state["discount_percents"][positions] = discount_percents
+    state["group_discounts"] = group_discounts
+    state["revision"] += 1
+    state["table"] = None
+    return state["net_prices"], state["discount_percents"]
+
+# -------------------------------
+# Edit Journal (Undo/Redo)
+# -------------------------------
+# Each user action that changes special rates or group discounts is recorded
+# as one journal entry of compact deltas: the row positions / group ids it
+# changed with their old and new values. Undo and redo write those values
+# back, so the incremental pricing only re-prices the affected rows.
+JOURNAL_MAX_ENTRIES = 50
+
+def _changed(old, new):
+    """Mask of array entries that differ (NaN equals NaN)"""
+    return ~((old == new) | (np.isnan(old) & np.isnan(new)))
+
+class EditJournal:
+    """Append-only undo/redo history of edits for one rate card version"""
+    
+    def __init__(self, version):
+        self.version = version
+        self.undo_stack = []
+        self.redo_stack = []
+    
+    def record(self, label, before, store, vector):
+        """Record the difference between a snapshot and the current state - returns False if nothing changed"""
+        (old_prices, old_set, old_poa), old_discounts = before
+        new_prices, new_set, new_poa = store.snapshot()
+        positions = np.flatnonzero(_changed(old_prices, new_prices) | (old_set != new_set) | (old_poa != new_poa))
+        group_ids = np.flatnonzero(_changed(old_discounts, vector.values))
+        if len(positions) == 0 and len(group_ids) == 0:
+            return False
+        self.undo_stack.append({
+            "label": label,
+            "positions": positions,
+            "old": (old_prices[positions], old_set[positions], old_poa[positions]),
+            "new": (new_prices[positions], new_set[positions], new_poa[positions]),
+            "group_ids": group_ids,
+            "old_discounts": old_discounts[group_ids],
+            "new_discounts": vector.values[group_ids].copy(),
+        })
+        del self.undo_stack[:-JOURNAL_MAX_ENTRIES]
+        self.redo_stack.clear()
+        return True
+    
+    def _apply(self, entry, side, store, vector):
+        if len(entry["positions"]):
+            store.restore(entry["positions"], *entry[side])
+        if len(entry["group_ids"]):
+            vector.values[entry["group_ids"]] = entry[f"{side}_discounts"]
+    
+    def undo(self, store, vector):
+        """Revert the last recorded action - returns its label (None if nothing to undo)"""
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        self._apply(entry, "old", store, vector)
+        self.redo_stack.append(entry)
+        return entry["label"]
+    
+    def redo(self, store, vector):
+        """Re-apply the last undone action - returns its label (None if nothing to redo)"""
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        self._apply(entry, "new", store, vector)
+        self.undo_stack.append(entry)
+        return entry["label"]
+
+def get_edit_journal():
+    """Get this session's edit journal for its rate card version"""
+    entry = get_session_rate_card()
+    journal = st.session_state.get('edit_journal')
+    if journal is None or journal.version != entry["version"]:
+        # Positions and group ids are per rate card version, so history doesn't carry over
+        journal = EditJournal(entry["version"])
+        st.session_state['edit_journal'] = journal
+    return journal
+
+@contextmanager
+def journal_edit(label):
+    """Record every special rate / group discount change made inside the block as one undoable action"""
+    store = get_custom_price_store()
+    vector = get_group_discount_vector()
+    before = (store.snapshot(), vector.values.copy())
+    try:
+        yield
+    finally:
+        # Recorded even when the block ends with st.rerun()
+        get_edit_journal().record(label, before, store, vector)
+
+def undo_last_edit():
+    """Undo the last journaled action - returns its label"""
+    return get_edit_journal().undo(get_custom_price_store(), get_group_discount_vector())
+
+def redo_last_edit():
+    """Redo the last undone action - returns its label"""
+    return get_edit_journal().redo(get_custom_price_store(), get_group_discount_vector())
+
+# -------------------------------
+# Equipment Search
+# -------------------------------
+# Token/prefix inverted index over EquipmentName and ItemCategory, built once
+# per rate card version. A query is split into tokens the same way; each token
+# matches every indexed token it is a prefix of, and all tokens must match
+# (so "nav 4.5" finds "Navigator 4.5 ...").
+SEARCH_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./][a-z0-9]+)*")
+
+def tokenize_search_text(text):
+    """Split text into lowercase search tokens (keeps codes like 01/630 and sizes like 4.5)"""
+    return SEARCH_TOKEN_PATTERN.findall(str(text).lower())
+
+def build_search_index(df):
+    """Build the token -> row positions index of a rate card"""
+    postings = {}
+    texts = df["EquipmentName"].astype(str) + " " + df["ItemCategory"].astype(str)
+    for position, text in enumerate(texts):
+        for token in tokenize_search_text(text):
+            # Index compound tokens whole and by part ("drill/chipping" -> drill, chipping)
+            for part in {token, *re.split(r"[./]", token)}:
+                postings.setdefault(part, set()).add(position)
+    vocabulary = sorted(postings)
+    return {
+        "vocabulary": vocabulary,
+        "postings": [np.array(sorted(postings[token]), dtype=int) for token in vocabulary],
+    }
+
+def search_index_positions(search_index, query):
+    """Get the sorted row positions matching every token of a query (by prefix)"""
+    tokens = tokenize_search_text(query)
+    if not tokens:
+        return np.array([], dtype=int)
+    vocabulary = search_index["vocabulary"]
+    matches = None
+    # Most selective (longest) tokens first so the intersection shrinks quickly
+    for token in sorted(set(tokens), key=len, reverse=True):
+        start = bisect.bisect_left(vocabulary, token)
+        end = bisect.bisect_left(vocabulary, token + "\uffff", lo=start)
+        if start == end:
+            return np.array([], dtype=int)
+        token_matches = np.unique(np.concatenate(search_index["postings"][start:end]))
+        matches = token_matches if matches is None else np.intersect1d(matches, token_matches, assume_unique=True)
+        if len(matches) == 0:
+            break
+    return matches
+
+def search_equipment(query):
+    """Search this session's rate card - returns matching row positions in rate card order"""
+    return search_index_positions(get_session_rate_card()["search"], query)
+
+# Fuzzy search for misspelt names ("pecolift" vs "peco lift"): texts are
+# indexed by the trigrams of their padded words, and a query scores each text
+# by the share of its own trigrams found there, using only the posting lists
+# of the query's trigrams (no scan of the texts themselves).
+FUZZY_MIN_SIMILARITY = 0.5
+
+def get_trigrams(text):
+    """Get the set of word trigrams of a text (words padded like "  word ")"""
+    trigrams = set()
+    for word in re.findall(r"[a-z0-9]+", str(text).lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+def build_trigram_index(texts):
+    """Build the trigram -> text positions index of a list of texts"""
+    postings = {}
+    sizes = []
+    for position, text in enumerate(texts):
+        trigrams = get_trigrams(text)
+        sizes.append(len(trigrams))
+        for trigram in trigrams:
+            postings.setdefault(trigram, []).append(position)
+    return {
+        "postings": {trigram: np.array(positions, dtype=int) for trigram, positions in postings.items()},
+        "sizes": np.array(sizes, dtype=int),
+    }
+
+def trigram_search(trigram_index, query, limit=10, min_similarity=FUZZY_MIN_SIMILARITY, candidates=None):
+    """Rank texts by trigram similarity to a query.
+    
+    Args:
+        candidates: optional boolean mask of the texts that may be returned
+    
+    Returns:
+        (positions, similarities): best first, at most `limit`, all >= min_similarity
+    """
+    query_trigrams = get_trigrams(query)
+    sizes = trigram_index["sizes"]
+    if not query_trigrams or len(sizes) == 0:
+        return np.array([], dtype=int), np.array([], dtype="float64")
+    postings = [trigram_index["postings"][t] for t in query_trigrams if t in trigram_index["postings"]]
+    if not postings:
+        return np.array([], dtype=int), np.array([], dtype="float64")
+    shared = np.bincount(np.concatenate(postings), minlength=len(sizes))
+    similarity = shared / len(query_trigrams)
+    if candidates is not None:
+        similarity = np.where(candidates, similarity, 0.0)
+    positions = np.flatnonzero(similarity >= min_similarity)
+    # Best share of the query first, then the closest overall match (Jaccard)
+    jaccard = shared[positions] / (len(query_trigrams) + sizes[positions] - shared[positions])
+    order = np.lexsort((positions, -jaccard, -similarity[positions]))[:limit]
+    return positions[order], similarity[positions[order]]
+
+def fuzzy_search_equipment(query, limit=10, min_similarity=FUZZY_MIN_SIMILARITY):
+    """Fuzzy search this session's rate card by name/code - returns (row positions, similarities)"""
+    return trigram_search(get_session_rate_card()["trigrams"], query, limit, min_similarity)
+
+def fuzzy_search_conversion_table(query, product_type=None, limit=10, min_similarity=FUZZY_MIN_SIMILARITY):
+    """Fuzzy search the conversion table's EQP_NAME - returns (row positions, similarities)"""
+    entry = get_current_source("conversion_table")
+    candidates = entry["product_types"] == product_type if product_type is not None else None
+    return trigram_search(entry["trigrams"], query, limit, min_similarity, candidates)
+
 # -------------------------------
 # Export Helper Functions
 # -------------------------------
@@ -497,9 +1705,9 @@ def create_admin_dataframe(df, customer_name):
         "CustomPrice", "DiscountPercent", "GroupName", "Sub Section"
     ]].copy()
     
-    admin_df["HireRateWeekly"] = admin_df["HireRateWeekly"].apply(format_price_for_export)
-    admin_df["CustomPrice"] = admin_df["CustomPrice"].apply(format_custom_price_for_export)
-    admin_df["DiscountPercent"] = admin_df["DiscountPercent"].apply(format_discount_for_export)
+    admin_df["HireRateWeekly"] = format_price_array(admin_df["HireRateWeekly"], prefix="")
+    admin_df["CustomPrice"] = format_price_array(admin_df["CustomPrice"], prefix="")
+    admin_df["DiscountPercent"] = format_price_array(admin_df["DiscountPercent"], prefix="", suffix="%")
     
     admin_df.columns = [
         "Item Category", "Equipment Name", "Original Price (£)", 
@@ -527,67 +1735,207 @@ def create_transport_dataframe():
             })
     return pd.DataFrame(transport_inputs)
 
+def create_admin_workbook(admin_df, transport_df, customer_name, global_discount):
+    """Create the admin Excel export (price list, transport charges and summary sheets) as bytes"""
+    output_excel = io.BytesIO()
+    with pd.ExcelWriter(output_excel, engine='openpyxl') as writer:
+        admin_df.to_excel(writer, sheet_name='Price List', index=False)
+        transport_df.to_excel(writer, sheet_name='Transport Charges', index=False)
+        
+        summary_data = {
+            'Customer': [customer_name],
+            'Total Items': [len(admin_df)],
+            'Global Discount %': [global_discount],
+            'Date Created': [get_uk_time().strftime("%Y-%m-%d %H:%M")],
+            'Created By': ['Net Rates Calculator']
+        }
+        pd.DataFrame(summary_data).to_excel(writer, sheet_name='Summary', index=False)
+    return output_excel.getvalue()
+
 # -------------------------------
 # Progress Save/Load Functions
 # -------------------------------
-def create_save_data(customer_name, df):
-    """Create save data dictionary for progress saving"""
-    global_discount = st.session_state.get('global_discount', 0)
-    
+# Progress files are versioned. Version 2 adds "format_version" and is saved as
+# gzip-compressed compact JSON (.json.gz); files without a version are legacy
+# version 1 - indented plain JSON, whose custom_prices may be keyed
+# "index_{row}" by the single-page app. Both load through decode_progress.
+PROGRESS_FORMAT_VERSION = 2
+PROGRESS_FILE_TYPES = ["gz", "json"]
+GZIP_MAGIC = b"\x1f\x8b"
+
+def build_save_data(customer_name, global_discount, vector, store, transport_charges):
+    """Build the progress save format from a group discount vector and special rate store (either may be None)"""
     custom_prices = {}
-    if df is not None and not df.empty:
-        for idx, row in df.iterrows():
-            price_key = f"price_{idx}"
-            item_key = str(row["ItemCategory"])
-            price_value = st.session_state.get(price_key, "")
-            if price_value:
-                custom_prices[item_key] = price_value
-    
-    # Capture group discounts (exclude global_discount itself)
-    group_discounts = {
-        key: st.session_state[key]
-        for key in st.session_state
-        if key.endswith("_discount") and key != "global_discount"
-    }
+    if store is not None:
+        for _, item_key, price_value in store.items():
+            custom_prices[item_key] = price_value
+    
+    # Group discounts keep the "{group}_{subsection}_discount" keys of the save format
+    group_discounts = dict(vector.items()) if vector is not None else {}
     
     return {
+        "format_version": PROGRESS_FORMAT_VERSION,
         "customer_name": customer_name,
         "global_discount": global_discount,
         "group_discounts": group_discounts,
         "custom_prices": custom_prices,
-        "transport_charges": {
+        "transport_charges": transport_charges
+    }
+
+def create_save_data(customer_name, df):
+    """Create save data dictionary for progress saving"""
+    return build_save_data(
+        customer_name,
+        st.session_state.get('global_discount', 0),
+        get_group_discount_vector() if df is not None else None,
+        get_custom_price_store() if df is not None and not df.empty else None,
+        {
             key: st.session_state[key]
             for key in st.session_state
             if key.startswith("transport_")
         }
+    )
+
+def encode_progress(save_data, compress=True):
+    """Encode progress data as compressed compact JSON (bytes), or indented JSON text for reading"""
+    if not compress:
+        return json.dumps(save_data, indent=2)
+    return gzip.compress(json.dumps(save_data, separators=(",", ":")).encode("utf-8"), mtime=0)
+
+def _progress_mapping(data, name):
+    value = data.get(name)
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError(f"'{name}' must be an object")
+    return value
+
+def _progress_number(value, name):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"'{name}' must be a number, not {value!r}")
+    return float(value)
+
+def decode_progress(raw):
+    """
+    Decode and validate a progress file (compressed or plain JSON, any format version).
+    
+    Returns the progress data in the current format version; raises ValueError
+    with a message for the user if the file isn't a valid progress file.
+    """
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if raw[:2] == GZIP_MAGIC:
+        try:
+            raw = gzip.decompress(raw)
+        except (OSError, EOFError, zlib.error) as e:
+            raise ValueError(f"Compressed progress file is damaged: {e}") from e
+    try:
+        data = json.loads(raw.decode("utf-8-sig"))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Not a progress file: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("Not a progress file: expected a JSON object")
+    
+    version = data.get("format_version", 1)  # Legacy files have no version
+    if isinstance(version, bool) or not isinstance(version, int) or version < 1:
+        raise ValueError(f"Unknown progress format version: {version!r}")
+    if version > PROGRESS_FORMAT_VERSION:
+        raise ValueError(f"Progress file is format version {version} - this app reads up to version {PROGRESS_FORMAT_VERSION}")
+    
+    customer_name = data.get("customer_name") or ""
+    if not isinstance(customer_name, str):
+        raise ValueError("'customer_name' must be text")
+    custom_prices = _progress_mapping(data, "custom_prices")
+    for code, value in custom_prices.items():
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (str, int, float))):
+            raise ValueError(f"Special rate for {code} must be a price or POA, not {value!r}")
+    transport_charges = {
+        key: value
+        for key, value in _progress_mapping(data, "transport_charges").items()
+        if key.startswith("transport_")
+    }
+    for key, value in transport_charges.items():
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f"'{key}' must be a charge, not {value!r}")
+        transport_charges[key] = str(value)  # Shown in text inputs
+    
+    return {
+        "format_version": PROGRESS_FORMAT_VERSION,
+        "customer_name": customer_name,
+        "global_discount": _progress_number(data.get("global_discount", 0.0), "global_discount"),
+        # Legacy saves hold every "*_discount" session key - values that were never set are skipped
+        "group_discounts": {
+            key: _progress_number(value, key)
+            for key, value in _progress_mapping(data, "group_discounts").items()
+            if value is not None
+        },
+        "custom_prices": custom_prices,
+        "transport_charges": transport_charges,
+    }
+
+def get_progress_download(customer_name, df, compress=True):
+    """
+    Get the Save Progress file contents as a callable for st.download_button.
+    
+    Serialization only runs when the download is requested, and only once per
+    pricing state: the result is kept in session state until special rates,
+    group discounts, the global discount, transport charges or the name change.
+    """
+    global_discount = st.session_state.get('global_discount', 0)
+    vector = get_group_discount_vector() if df is not None else None
+    store = get_custom_price_store() if df is not None and not df.empty else None
+    transport_charges = {
+        key: st.session_state[key]
+        for key in st.session_state
+        if key.startswith("transport_")
     }
+    state_key = (
+        customer_name, global_discount, repr(sorted(transport_charges.items())),
+        vector.values.tobytes() if vector is not None else None,
+        (id(store), store.revision) if store is not None else None,
+    )
+    # Download callables run outside the script thread - they only see what is captured here
+    memo = st.session_state.setdefault('progress_download', {}).setdefault(compress, {"key": None, "data": None})
+    
+    def serialize():
+        if memo["key"] != state_key:
+            save_data = build_save_data(customer_name, global_discount, vector, store, transport_charges)
+            memo["data"] = encode_progress(save_data, compress)
+            memo["key"] = state_key
+        return memo["data"]
+    
+    return serialize
 
 def apply_loaded_data(loaded_data, df):
-    """Apply loaded progress data to session state"""
+    """Apply loaded progress data (see decode_progress) to session state in one bulk overlay"""
     st.session_state["customer_name"] = loaded_data.get("customer_name", "")
     st.session_state["global_discount"] = loaded_data.get("global_discount", 0.0)
     
-    # Apply group discounts
-    for key, value in loaded_data.get("group_discounts", {}).items():
-        st.session_state[key] = value
-    
     # Apply transport charges
     for key, value in loaded_data.get("transport_charges", {}).items():
         st.session_state[key] = value
     
-    # Apply custom prices
-    if df is not None and not df.empty:
-        custom_prices = loaded_data.get("custom_prices", {})
-        item_category_to_index = {str(row["ItemCategory"]): idx for idx, row in df.iterrows()}
+    if df is None:
+        return
+    
+    with journal_edit("Load progress"):
+        # Apply group discounts
+        get_group_discount_vector().set_many_by_key(loaded_data.get("group_discounts", {}))
         
-        for item_category, price_value in custom_prices.items():
-            if item_category in item_category_to_index and price_value:
-                idx = item_category_to_index[item_category]
-                price_key = f"price_{idx}"
-                input_key = f"input_{idx}"
-                price_str = str(price_value)
-                st.session_state[price_key] = price_str
-                st.session_state[input_key] = price_str
+        # Apply custom prices - by ItemCategory, or by rate card row for legacy "index_{row}" keys
+        custom_prices = loaded_data.get("custom_prices", {})
+        if not df.empty and custom_prices:
+            rate_card = get_session_rate_card()
+            keys = pd.Series(list(custom_prices), dtype=object).astype(str).str.strip()
+            positions = keys.map(rate_card["index"]["positions_by_code"])
+            is_row_key = positions.isna() & keys.str.match(r"index_\d+$")
+            if is_row_key.any():
+                row_labels = keys[is_row_key].str[len("index_"):].astype(int)
+                row_positions = rate_card["data"].index.get_indexer(row_labels)
+                positions[is_row_key] = np.where(row_positions >= 0, row_positions, np.nan)
+            known = positions.notna().to_numpy()
+            values = np.array(list(custom_prices.values()), dtype=object)
+            get_custom_price_store().set_many(positions[known].astype(int).to_numpy(), values[known])
 
 
 # -------------------------------
@@ -599,27 +1947,47 @@ def add_shared_sidebar():
         # Save Progress Section
         st.markdown("### 💾 Progress")
         
-        df = st.session_state.get('df')
+        df = get_session_dataframe(report_errors=False)
         customer_name = st.session_state.get('customer_name', '')
         
         # Save Progress Button
         if df is not None:
-            save_data = create_save_data(customer_name or "Unsaved", df)
-            json_data = json.dumps(save_data, indent=2)
             timestamp = get_uk_time().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"{customer_name or 'progress'}_{timestamp}.json"
+            filename = f"{customer_name or 'progress'}_{timestamp}.json.gz"
             
             st.download_button(
                 label="💾 Save Progress",
-                data=json_data,
+                data=get_progress_download(customer_name or "Unsaved", df),
                 file_name=filename,
-                mime="application/json",
+                mime="application/gzip",
                 use_container_width=True,
-                help="Download your current progress as a JSON file"
+                help="Download your current progress as a compressed progress file"
             )
         
         st.caption("📂 Load progress on Discounts page")
         
+        # Undo/Redo of price and discount edits
+        if df is not None:
+            journal = get_edit_journal()
+            col_undo, col_redo = st.columns(2)
+            with col_undo:
+                undo_help = f"Undo: {journal.undo_stack[-1]['label']}" if journal.undo_stack else "Nothing to undo"
+                if st.button("↩️ Undo", use_container_width=True, disabled=not journal.undo_stack, help=undo_help):
+                    st.toast(f"↩️ Undone: {undo_last_edit()}")
+                    st.rerun()
+            with col_redo:
+                redo_help = f"Redo: {journal.redo_stack[-1]['label']}" if journal.redo_stack else "Nothing to redo"
+                if st.button("↪️ Redo", use_container_width=True, disabled=not journal.redo_stack, help=redo_help):
+                    st.toast(f"↪️ Redone: {redo_last_edit()}")
+                    st.rerun()
+        
+        if is_new_rate_card_available():
+            st.info("🆕 A new rate card is available")
+            if st.button("🔄 Switch to New Rate Card", use_container_width=True,
+                         help="Custom prices are kept for items that are still on the rate card"):
+                switch_to_current_rate_card()
+                st.rerun()
+        
         st.markdown("---")
         st.markdown("### 🔐 Session")
         if st.button("🚪 Logout", use_container_width=True):
@@ -664,7 +2032,8 @@ def read_pdf_header(file):
 
 
 def generate_customer_pdf(df, customer_name, header_pdf_file, include_custom_table=True, 
-                          special_rates_pagebreak=False, special_rates_spacing=0):
+                          special_rates_pagebreak=False, special_rates_spacing=0,
+                          store=None, rate_card_index=None):
     """
     Generate customer PDF with price list - Single source of truth for PDF generation.
     
@@ -675,6 +2044,8 @@ def generate_customer_pdf(df, customer_name, header_pdf_file, include_custom_tab
         include_custom_table: Whether to include special rates table at the top
         special_rates_pagebreak: Whether to put special rates on a separate page
         special_rates_spacing: Number of blank lines after special rates
+        store: Special rate store (defaults to this session's)
+        rate_card_index: Rate card index bundle (defaults to this session's rate card)
     
     Returns:
         bytes: The merged PDF as bytes, or None if generation fails
@@ -719,25 +2090,24 @@ def generate_customer_pdf(df, customer_name, header_pdf_file, include_custom_tab
             leading=18,
         ))
 
+        if store is None:
+            store = get_custom_price_store()
+        has_special_rate_by_index = pd.Series(store.is_set & ~store.is_poa, index=df.index)
+        
         # Custom Price Products Table at the Top
         if include_custom_table:
             custom_price_items = []
-            for idx, row in df.iterrows():
-                price_key = f"price_{idx}"
-                user_input = str(st.session_state.get(price_key, "")).strip()
-                if user_input:
-                    if not is_poa_value(user_input):
-                        try:
-                            entered_price = float(user_input)
-                            custom_price_items.append({
-                                'subsection': row["Sub Section"],
-                                'category': row["ItemCategory"],
-                                'equipment': row["EquipmentName"],
-                                'price': entered_price,
-                                'original_index': idx
-                            })
-                        except ValueError:
-                            continue
+            for position in store.positions():
+                if store.is_poa[position]:
+                    continue
+                row = df.iloc[position]
+                custom_price_items.append({
+                    'subsection': row["Sub Section"],
+                    'category': row["ItemCategory"],
+                    'equipment': row["EquipmentName"],
+                    'price': store.prices[position],
+                    'original_index': row.name
+                })
 
             if custom_price_items:
                 customer_title = customer_name if customer_name else "Customer"
@@ -805,7 +2175,12 @@ def generate_customer_pdf(df, customer_name, header_pdf_file, include_custom_tab
         table_col_widths = [60, 380, 60]
         bar_width = sum(table_col_widths)
 
-        for group, group_df in df.groupby("GroupName"):
+        # Regroup with the rate card's cached group ranges instead of a groupby
+        if rate_card_index is None:
+            rate_card_index = get_session_rate_card()["index"]
+        group_ranges = rate_card_index["ranges"]
+
+        for group, subsections in rate_card_index["subsections_by_group"].items():
             group_elements = []
 
             bar_table = Table(
@@ -824,7 +2199,8 @@ def generate_customer_pdf(df, customer_name, header_pdf_file, include_custom_tab
             group_spacer = Spacer(1, 2)
             group_subsection_blocks = []
 
-            for subsection, sub_df in group_df.groupby("Sub Section"):
+            for subsection in subsections:
+                sub_df = df.iloc[group_ranges[(group, subsection)]]
                 if pd.isnull(subsection) or str(subsection).strip() == "" or subsection == "nan":
                     subsection_title = "Untitled"
                 else:
@@ -840,15 +2216,13 @@ def generate_customer_pdf(df, customer_name, header_pdf_file, include_custom_tab
                 special_rate_rows = []
                 
                 for row_idx, (_, row) in enumerate(sub_df.iterrows(), start=1):
-                    if is_poa_value(row['CustomPrice']) or row['CustomPrice'] == "POA":
+                    if pd.isna(row['CustomPrice']) or is_poa_value(row['CustomPrice']) or row['CustomPrice'] == "POA":
                         price_text = "POA"
                         has_special_rate = False
                     else:
                         try:
                             price_text = f"£{float(row['CustomPrice']):.2f}"
-                            price_key = f"price_{row.name}"
-                            user_input = str(st.session_state.get(price_key, "")).strip()
-                            has_special_rate = bool(user_input and not is_poa_value(user_input))
+                            has_special_rate = bool(has_special_rate_by_index[row.name])
                         except (ValueError, TypeError):
                             price_text = "POA"
                             has_special_rate = False